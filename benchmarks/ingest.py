@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Ingest benchmark -- runs the elastify ingest path over a parameter grid.
+Synthesises corpora shaped like ours (short titles as .jsonl lines, long
+fulltexts as .txt files, .json records with many fields) and bulks them with
+every combination of jobs, chunk size, worker processes and refresh interval,
+by default against an in-process stand-in (see elastify/standin.py). Each run
+appends a json line with docs/s, MB/s, client CPU seconds, peak RSS and the
+bulk latency percentiles to the results file.
+
+    python3 benchmarks/ingest.py --docs 20000 --jobs 1,4 --processes 0,2
+"""
+from __future__ import print_function
+from itertools import product
+from multiprocessing import Process, Queue
+from queue import Empty
+from timeit import default_timer
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from elasticsearch import Elasticsearch  # noqa: E402
+from elastify import bulk  # noqa: E402
+from elastify.elastify import (ActionBuilder, generate_units,  # noqa: E402
+                               pooled_items, serialize_units)
+from elastify.standin import StandIn  # noqa: E402
+from elastify.telemetry import Telemetry, percentile  # noqa: E402
+
+CORPORA = ('titles', 'fulltext', 'fields')
+
+
+def _words(rnd, vocabulary, n):
+    return ' '.join(rnd.choice(vocabulary) for _ in range(n))
+
+
+def make_corpus(kind, directory, n_docs, seed=0):
+    """ Writes n_docs synthetic documents of kind (one of CORPORA) below
+    directory, the same ones for the same seed """
+    rnd = random.Random(seed)
+    # zipf-ish vocabulary: few frequent short words, many rare long ones
+    vocabulary = ["w%x" % int(rnd.paretovariate(1.2) * 10)
+                  for _ in range(50000)]
+    if kind == 'titles':
+        with open(os.path.join(directory, 'titles.jsonl'), 'w') as out:
+            for i in range(n_docs):
+                out.write(json.dumps({"id": str(i), "title": _words(
+                    rnd, vocabulary, rnd.randint(4, 15))}) + '\n')
+    elif kind == 'fulltext':
+        for i in range(n_docs):
+            with open(os.path.join(directory, '%07d.txt' % i), 'w') as out:
+                out.write(_words(rnd, vocabulary, rnd.randint(1000, 8000)))
+    elif kind == 'fields':
+        for i in range(n_docs):
+            record = {"title": _words(rnd, vocabulary, rnd.randint(4, 15)),
+                      "abstract": _words(rnd, vocabulary,
+                                         rnd.randint(80, 300)),
+                      "authors": [_words(rnd, vocabulary, 2)
+                                  for _ in range(rnd.randint(1, 6))],
+                      "subjects": [rnd.choice(vocabulary)
+                                   for _ in range(rnd.randint(2, 12))],
+                      "year": rnd.randint(1950, 2017)}
+            for j in range(30):
+                record["field%02d" % j] = _words(rnd, vocabulary, 3)
+            with open(os.path.join(directory, '%07d.json' % i), 'w') as out:
+                json.dump(record, out)
+    else:
+        raise ValueError("Unknown corpus %s" % kind)
+    return directory
+
+
+def ingest(client, path, index, jobs=1, chunk_size=1000, processes=0,
+           refresh='-1', max_chunk_mb=10):
+    """ Bulks path into index like elastify does and returns its metrics """
+    client.indices.create(index=index)
+    client.indices.put_settings(index=index,
+                                body={"refresh_interval": refresh})
+    builder = ActionBuilder(index, 'publication')
+    units = enumerate(generate_units(path, builder))
+    if processes:
+        items = pooled_items(units, builder, processes)
+    else:
+        items = serialize_units(builder, units, client.transport.serializer)
+    sizer = bulk.BulkSizer(chunk_size=chunk_size,
+                           max_chunk_bytes=int(max_chunk_mb * 1024 * 1024))
+    with open(os.devnull, 'w') as devnull:
+        telemetry = Telemetry(interval=float('inf'), out=devnull)
+        start, cpu_start = default_timer(), os.times()
+        for success, _, _ in bulk.adaptive_bulk(client, items, sizer,
+                                                thread_count=jobs,
+                                                telemetry=telemetry):
+            telemetry.result(success)
+        wall = default_timer() - start
+        cpu = os.times()
+    client.indices.delete(index=index)
+    latencies = sorted(telemetry.latencies)
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'docs': telemetry.n_success, 'failed': telemetry.n_fails,
+            'chunks': telemetry.n_chunks, 'mb': telemetry.n_bytes / 1024. ** 2,
+            'seconds': wall,
+            'docs_per_s': telemetry.n_success / wall,
+            'mb_per_s': telemetry.n_bytes / 1024. ** 2 / wall,
+            # user + system time of this process and its worker processes
+            'client_cpu_s': sum(cpu[:4]) - sum(cpu_start[:4]),
+            'peak_rss_mb': peak_kb / 1024.,
+            'latency_p50_ms': 1000 * percentile(latencies, 50),
+            'latency_p90_ms': 1000 * percentile(latencies, 90),
+            'latency_p99_ms': 1000 * percentile(latencies, 99)}
+
+
+def _run(results, hosts, path, index, params):
+    """ Runs one grid point in a fresh process, so CPU and peak RSS are its
+    own and the stand-in's work is not counted """
+    client = Elasticsearch(hosts, timeout=3600)
+    results.put(ingest(client, path, index, **params))
+
+
+def _wait(worker, results, poll=1.):
+    """ Returns the metrics of a worker started with _run, or None if it died
+    without any """
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except Empty:
+            if worker.exitcode is not None:
+                return None
+
+
+def main():
+    """ Runs the benchmark grid and appends the results """
+    def ints(value):
+        return [int(v) for v in value.split(',')]
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--corpora", type=lambda v: v.split(','),
+                        default=list(CORPORA),
+                        help="Comma separated subset of %s" % ', '.join(CORPORA))
+    parser.add_argument("--docs", type=int, default=10000,
+                        help="Documents per corpus [10000]")
+    parser.add_argument("--jobs", type=ints, default=[1, 4],
+                        help="Comma separated sender thread counts [1,4]")
+    parser.add_argument("--chunk-sizes", type=ints, default=[500, 2000],
+                        help="Comma separated initial chunk sizes [500,2000]")
+    parser.add_argument("--processes", type=ints, default=[0, 2],
+                        help="Comma separated worker process counts, 0 to\
+                        serialise in the main process [0,2]")
+    parser.add_argument("--refresh", type=lambda v: v.split(','),
+                        default=['-1'],
+                        help="Comma separated refresh intervals during the\
+                        ingest [-1]")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per grid point")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="Latency of the stand-in per request (s)")
+    parser.add_argument("--hosts", type=str, default=None,
+                        help="Benchmark against this cluster instead of the\
+                        stand-in, e.g. localhost:9200")
+    parser.add_argument("-o", "--output", type=str,
+                        default="ingest-results.jsonl",
+                        help="File to append the results to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    standin = None
+    if args.hosts:
+        hosts = args.hosts.split(',')
+    else:
+        standin = StandIn(latency=args.latency, keep_sources=False).start()
+        hosts = standin.hosts
+    workdir = tempfile.mkdtemp(prefix="elastify-bench-")
+    n_failed = 0
+    try:
+        with open(args.output, 'a') as output:
+            for corpus in args.corpora:
+                path = make_corpus(corpus, tempfile.mkdtemp(dir=workdir),
+                                   args.docs, seed=args.seed)
+                grid = product(args.jobs, args.chunk_sizes, args.processes,
+                               args.refresh, range(args.repeat))
+                for jobs, chunk_size, processes, refresh, run in grid:
+                    params = {'jobs': jobs, 'chunk_size': chunk_size,
+                              'processes': processes, 'refresh': refresh}
+                    results = Queue()
+                    worker = Process(target=_run, args=(
+                        results, hosts, path, "bench-%s" % corpus, params))
+                    worker.start()
+                    metrics = _wait(worker, results)
+                    worker.join()
+                    if metrics is None:
+                        n_failed += 1
+                        print("[bench] Error: %-8s jobs %2d chunk %5d"
+                              " processes %d refresh %-3s failed with exit"
+                              " code %d" % (corpus, jobs, chunk_size,
+                                            processes, refresh,
+                                            worker.exitcode),
+                              file=sys.stderr)
+                        continue
+                    record = dict(params, corpus=corpus, n_docs=args.docs,
+                                  run=run, target=args.hosts or 'standin',
+                                  python=platform.python_version(),
+                                  time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                                  **metrics)
+                    print(json.dumps(record), file=output, flush=True)
+                    print("[bench] %-8s jobs %2d chunk %5d processes %d"
+                          " refresh %-3s: %8.0f docs/s %7.2f MB/s cpu %6.2f s"
+                          " rss %6.1f MB p50 %5.0f p99 %5.0f ms"
+                          % (corpus, jobs, chunk_size, processes, refresh,
+                             metrics['docs_per_s'], metrics['mb_per_s'],
+                             metrics['client_cpu_s'], metrics['peak_rss_mb'],
+                             metrics['latency_p50_ms'],
+                             metrics['latency_p99_ms']))
+    finally:
+        shutil.rmtree(workdir)
+        if standin:
+            standin.stop()
+    print("[bench] Results appended to %s" % args.output)
+    if n_failed:
+        print("[bench] Error: %d runs failed" % n_failed, file=sys.stderr)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
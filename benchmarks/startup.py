@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Startup benchmark -- how long the console scripts take before they do work.
+For every entry point in setup.py, runs `<script> --help` in a fresh
+interpreter and imports its module under -X importtime, then reports the
+wall time, the import time and the slowest imports it pulled in. Each run
+appends a json line to the results file; with --max-seconds the exit status
+is 1 if a script is slower, so regressions fail loudly.
+
+    python3 benchmarks/startup.py --repeat 5 --max-seconds 1
+"""
+from __future__ import print_function
+from timeit import default_timer
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+ENTRY_POINT = re.compile(r"'([\w-]+)\s*=\s*([\w.]+):(\w+)'")
+
+
+def entry_points(setup_py=os.path.join(ROOT, 'setup.py')):
+    """ Returns the (script, module) console scripts declared in setup.py """
+    with open(setup_py, 'r') as setup_file:
+        return [(script, module) for script, module, _
+                in ENTRY_POINT.findall(setup_file.read())]
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.abspath(ROOT), env.get('PYTHONPATH')]))
+    return env
+
+
+def help_time(module, repeat=3):
+    """ Best wall time of `python -m module --help` in seconds, or None with
+    the error if the module does not start """
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        proc = subprocess.run([sys.executable, '-m', module, '--help'],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, env=_env())
+        elapsed = default_timer() - start
+        if proc.returncode != 0:
+            return None, proc.stderr.decode('utf-8', 'replace').strip()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, None
+
+
+def import_times(module):
+    """ Parses -X importtime for module, returns (cumulative seconds of the
+    module, [(self seconds, name)] of everything it imported) """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           'import %s' % module],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          env=_env())
+    total, imports = None, []
+    for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(own) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+    return total, imports
+
+
+def main():
+    """ Measures the startup of all console scripts """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("scripts", nargs='*',
+                        help="Only these console scripts [all of setup.py]")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of --help per script, the best counts [3]")
+    parser.add_argument("--top", type=int, default=5,
+                        help="Slowest imports to report per script [5]")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Exit with 1 if a script needs longer for --help")
+    parser.add_argument("-o", "--output", type=str,
+                        default="startup-results.jsonl",
+                        help="File to append the results to")
+    args = parser.parse_args()
+
+    too_slow = []
+    with open(args.output, 'a') as output:
+        for script, module in entry_points():
+            if args.scripts and script not in args.scripts:
+                continue
+            seconds, error = help_time(module, args.repeat)
+            if error:
+                # a dependency missing here, not a startup problem
+                print("[bench] %-16s does not start: %s"
+                      % (script, error.splitlines()[-1]))
+                continue
+            total, imports = import_times(module)
+            slowest = sorted(imports, reverse=True)[:args.top]
+            record = {'script': script, 'module': module,
+                      'help_s': seconds, 'import_s': total,
+                      'n_modules': len(imports),
+                      'slowest': [[name, own] for own, name in slowest],
+                      'python': platform.python_version(),
+                      'time': time.strftime("%Y-%m-%dT%H:%M:%S")}
+            print(json.dumps(record), file=output, flush=True)
+            print("[bench] %-16s --help %6.0f ms, import %6.0f ms, %4d"
+                  " modules; slowest: %s"
+                  % (script, 1000 * seconds, 1000 * (total or 0),
+                     len(imports), ", ".join("%s %.0f ms" % (name, 1000 * own)
+                                             for own, name in slowest)))
+            if args.max_seconds is not None and seconds > args.max_seconds:
+                too_slow.append(script)
+    print("[bench] Results appended to %s" % args.output)
+    if too_slow:
+        print("[bench] Slower than %.2f s: %s"
+              % (args.max_seconds, ", ".join(too_slow)))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
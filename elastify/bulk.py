@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Adaptive bulk sending for elastify.
+Chunks are sized by both document count and bytes. The sizes shrink when
+elasticsearch rejects requests (429, 413) or the latency spikes and grow
+again while the cluster keeps up. Rejected items are retried with an
+exponential backoff instead of being counted as failures.
+"""
+from __future__ import print_function
+from elasticsearch import helpers
+from elasticsearch.client.utils import _make_path
+from elasticsearch.exceptions import TransportError
+from multiprocessing.pool import ThreadPool
+from queue import Full, Queue
+from threading import Event, Lock
+from timeit import default_timer
+
+import json
+import time
+
+# status codes that ask us to slow down and try again
+REJECTED = (429, 503)
+TOO_LARGE = 413
+
+
+class BulkSizer(object):
+    """ Chooses the size of the next chunk from the responses to the previous
+    ones. Shrinks multiplicatively on rejections and latency spikes, grows
+    multiplicatively while requests are accepted within the latency budget.
+    Also keeps the statistics of the run. Thread safe.
+    """
+
+    def __init__(self, chunk_size=1000, max_chunk_bytes=10 * 1024 * 1024,
+                 min_chunk_size=10, max_chunk_size=10000,
+                 max_bytes_limit=100 * 1024 * 1024, spike_factor=2.0,
+                 min_spike_latency=0.5, shrink=0.5, grow=1.1):
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.min_chunk_bytes = 64 * 1024
+        self.max_bytes_limit = max_bytes_limit
+        self.spike_factor = spike_factor
+        self.min_spike_latency = min_spike_latency
+        self.shrink = shrink
+        self.grow = grow
+        # smoothed seconds per byte, to tell latency spikes from big chunks
+        self._latency_per_byte = None
+        self._lock = Lock()
+        self.sizes = []
+        self.n_docs = 0
+        self.n_bytes = 0
+        self.n_rejected = 0
+        self.took = 0
+        self.latency = 0.
+        self.start = default_timer()
+
+    def _resize(self, factor):
+        self.chunk_size = int(min(self.max_chunk_size,
+                                  max(self.min_chunk_size,
+                                      self.chunk_size * factor)))
+        self.max_chunk_bytes = int(min(self.max_bytes_limit,
+                                       max(self.min_chunk_bytes,
+                                           self.max_chunk_bytes * factor)))
+
+    def accepted(self, n_docs, n_bytes, took, latency, n_rejected=0):
+        """ Records a chunk that elasticsearch answered. took is the
+        server side time in milliseconds, latency the wall time in seconds """
+        with self._lock:
+            self.sizes.append(n_docs)
+            self.n_docs += n_docs - n_rejected
+            self.n_bytes += n_bytes
+            self.took += took
+            self.latency += latency
+            per_byte = latency / max(n_bytes, 1)
+            spike = (self._latency_per_byte is not None and
+                     latency > self.min_spike_latency and
+                     per_byte > self.spike_factor * self._latency_per_byte)
+            if self._latency_per_byte is None:
+                self._latency_per_byte = per_byte
+            else:
+                self._latency_per_byte = (0.8 * self._latency_per_byte +
+                                          0.2 * per_byte)
+            if n_rejected:
+                self.n_rejected += n_rejected
+                self._resize(self.shrink)
+            elif spike:
+                self._resize((1 + self.shrink) / 2)
+            else:
+                self._resize(self.grow)
+
+    def rejected(self, n_docs):
+        """ Records a chunk that elasticsearch rejected as a whole """
+        with self._lock:
+            self.n_rejected += n_docs
+            self._resize(self.shrink)
+
+    def report(self):
+        """ Returns a summary of the chunk sizes and the throughput """
+        elapsed = max(default_timer() - self.start, 1e-9)
+        sizes = sorted(self.sizes) or [0]
+        n_chunks = max(len(self.sizes), 1)
+        return ("chunk sizes min %d, median %d, max %d, final %d docs / %.1f MB;"
+                " took %.0f ms, latency %.0f ms per chunk;"
+                " %.0f docs/s, %.2f MB/s; %d rejections retried"
+                % (sizes[0], sizes[len(sizes) // 2], sizes[-1],
+                   self.chunk_size, self.max_chunk_bytes / 1024 / 1024,
+                   self.took / n_chunks, 1000 * self.latency / n_chunks,
+                   self.n_docs / elapsed, self.n_bytes / 1024 / 1024 / elapsed,
+                   self.n_rejected))
+
+
+def serialize(actions, serializer, tag=None):
+    """ Serialises action dicts into (action line, data line, tag) items, the
+    data line is None for deletes. The tag is handed back with the result of
+    the item, e.g. to tell which document it belongs to. """
+    for action in actions:
+        action, data = helpers.expand_action(action)
+        yield (serializer.dumps(action),
+               serializer.dumps(data) if data is not None else None,
+               tag)
+
+
+def item_bytes(item):
+    """ Estimated bytes of a serialised item in the request body """
+    action_line, data_line, _ = item
+    return len(action_line) + 1 + (len(data_line) + 1 if data_line else 0)
+
+
+def chunk_items(items, sizer):
+    """ Groups serialised items into chunks, with the sizes the sizer
+    currently asks for """
+    chunk, size = [], 0
+    for item in items:
+        cur_size = item_bytes(item)
+        if chunk and (len(chunk) >= sizer.chunk_size or
+                      size + cur_size > sizer.max_chunk_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += cur_size
+    if chunk:
+        yield chunk
+
+
+def _body(chunk):
+    lines = []
+    for action_line, data_line, _ in chunk:
+        lines.append(action_line)
+        if data_line is not None:
+            lines.append(data_line)
+    newline = b'\n' if isinstance(lines[0], bytes) else '\n'
+    return newline.join(lines) + newline
+
+
+def _text(line):
+    return line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def _document(client, item):
+    """ (index, type, id) of the document of a serialised item, None if
+    elasticsearch generates its id """
+    _, action = client.transport.serializer.loads(item[0]).popitem()
+    if action.get('_id') is None:
+        return None
+    return action.get('_index'), action.get('_type'), str(action['_id'])
+
+
+def post_bulk(client, body, index=None, doc_type=None, **params):
+    """ Sends a bulk body and returns the response. A bytes body (raw
+    passthrough) is posted as it is, bypassing the client's serializer. """
+    if not isinstance(body, bytes):
+        return client.bulk(body, index=index, doc_type=doc_type, **params)
+    timeout = params.pop('request_timeout', None)
+    _, headers, data = client.transport.get_connection().perform_request(
+        'POST', _make_path(index, doc_type, '_bulk'), params, body,
+        timeout=timeout)
+    return client.transport.deserializer.loads(data,
+                                               headers.get('content-type'))
+
+
+def send_chunk(client, chunk, sizer, max_retries=8, initial_backoff=1,
+               max_backoff=60, telemetry=None, **kwargs):
+    """ Sends one chunk, retrying rejected items with an exponential backoff.
+    Returns a list of (success, result, item), success and result as in
+    helpers.streaming_bulk, item being the serialised item sent. Items may
+    be bytes (see post_bulk). Requests are reported to telemetry, if
+    given. """
+    results = []
+    attempt = 0
+    while chunk:
+        body = _body(chunk)
+        n_bytes = len(body)
+        start = default_timer()
+        if telemetry:
+            telemetry.chunk_started()
+        try:
+            resp = post_bulk(client, body, **kwargs)
+        except TransportError as e:
+            if telemetry:
+                telemetry.chunk_finished(n_bytes, default_timer() - start)
+            status = e.status_code
+            if status == TOO_LARGE and len(chunk) > 1:
+                sizer.rejected(len(chunk))
+                half = len(chunk) // 2
+                results.extend(send_chunk(client, chunk[:half], sizer,
+                                          max_retries, initial_backoff,
+                                          max_backoff, telemetry, **kwargs))
+                chunk = chunk[half:]
+                continue
+            # connection errors come without a numeric status
+            if (status in REJECTED or not isinstance(status, int)) and \
+                    attempt < max_retries:
+                sizer.rejected(len(chunk))
+                time.sleep(min(max_backoff, initial_backoff * 2 ** attempt))
+                attempt += 1
+                continue
+            # give up on this chunk, like raise_on_exception=False
+            for item in chunk:
+                op_type, action = client.transport.serializer.loads(
+                    item[0]).popitem()
+                info = {"error": str(e), "status": status, "exception": e}
+                info.update(action)
+                results.append((False, {op_type: info}, item))
+            return results
+        latency = default_timer() - start
+        if telemetry:
+            telemetry.chunk_finished(n_bytes, latency)
+
+        retry = []
+        # documents with a retried item, their later items are retried too
+        # so that the operations on a document keep their order
+        retried = set()
+        n_rejected = 0
+        for item, (op_type, result) in zip(chunk,
+                                           (i.popitem() for i in resp['items'])):
+            status = result.get('status', 500)
+            document = (_document(client, item)
+                        if status in REJECTED or retried else None)
+            if attempt < max_retries and (status in REJECTED or
+                                          document in retried):
+                n_rejected += status in REJECTED
+                if document is not None:
+                    retried.add(document)
+                retry.append(item)
+            elif 200 <= status < 300:
+                results.append((True, {op_type: result}, item))
+            else:
+                results.append((False, {op_type: result}, item))
+        sizer.accepted(len(chunk), n_bytes, resp.get('took', 0), latency,
+                       n_rejected=n_rejected)
+        if retry:
+            time.sleep(min(max_backoff, initial_backoff * 2 ** attempt))
+            attempt += 1
+        chunk = retry
+    return results
+
+
+def adaptive_bulk(client, items, sizer=None, thread_count=4, queue_size=4,
+                  **kwargs):
+    """ Sends serialised items (see serialize) in chunks chosen by sizer,
+    using thread_count threads. Yields (success, result, item) per item
+    (see send_chunk).
+    At most queue_size chunks are read ahead, so a slow cluster stalls the
+    reader instead of piling up chunks. """
+    sizer = sizer or BulkSizer()
+
+    stopped = Event()
+
+    class BlockingPool(ThreadPool):
+        """ Thread pool whose task queue blocks when full, until stopped """
+        def _setup_queues(self):
+            super(BlockingPool, self)._setup_queues()
+            self._inqueue = Queue(max(queue_size, thread_count))
+            self._quick_put = self._put
+
+        def _put(self, task):
+            while not stopped.is_set():
+                try:
+                    return self._inqueue.put(task, timeout=0.1)
+                except Full:
+                    pass
+
+    pool = BlockingPool(thread_count)
+    finished = False
+    try:
+        for results in pool.imap_unordered(
+                lambda chunk: send_chunk(client, chunk, sizer, **kwargs),
+                chunk_items(items, sizer)):
+            for result in results:
+                yield result
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # the consumer stopped early, do not read and send the rest
+            stopped.set()
+            pool.terminate()
+        pool.join()
+
+
+class DeadLetters(object):
+    """ Streams failed items with their error to an NDJSON file, one line
+    {"action": ..., "source": ..., "status": ..., "error": ...} per item.
+    The file is only opened when the first item fails. It is appended to, so
+    the failures of earlier runs that were not replayed yet are kept, unless
+    mode is 'w'. """
+
+    def __init__(self, filename, mode='a'):
+        self.filename = filename
+        self.mode = mode
+        self.count = 0
+        self._file = None
+
+    def write(self, item, result):
+        """ Appends a failed item and its result (see send_chunk) """
+        action_line, data_line, _ = item
+        info = list(result.values())[0]
+        if self._file is None:
+            self._file = open(self.filename, self.mode)
+        self._file.write('{"action": %s, "source": %s, "status": %s,'
+                         ' "error": %s}\n'
+                         % (_text(action_line), _text(data_line) or 'null',
+                            json.dumps(info.get('status')),
+                            json.dumps(info.get('error'), default=str)))
+        self.count += 1
+
+    def close(self):
+        """ Closes the file, if any was written """
+        if self._file is not None:
+            self._file.close()
+
+
+def read_dead_letters(filename, serializer, index=None):
+    """ Yields the items of a dead letter file as serialised items, optionally
+    redirected to another index """
+    with open(filename, 'r') as dead_letter_file:
+        for line in dead_letter_file:
+            record = json.loads(line)
+            if index:
+                list(record['action'].values())[0]['_index'] = index
+            source = record['source']
+            yield (serializer.dumps(record['action']),
+                   serializer.dumps(source) if source is not None else None,
+                   None)
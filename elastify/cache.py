@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Result cache for repeated evaluations.
+A local sqlite store keeps the ids and scores of the hits of every search,
+keyed by index, document type, size, query text and the strategy's template
+id, a hash of the query the strategy sends. The entries of an index are dropped
+as soon as its generation changes, i.e. its document counts or the commit
+generation of one of its shards, so a cached result is never older than the
+index it was retrieved from.
+"""
+from __future__ import print_function
+from array import array
+
+import hashlib
+import json
+import sqlite3
+
+try:
+    import elastify.clients as clients
+    import elastify.utils as utils
+except ImportError:
+    import clients
+    import utils
+
+
+def index_generation(client, index):
+    """ Returns a string that changes whenever the documents of index do:
+    document counts and commit generations of all its shards """
+    stats = client.indices.stats(index=index, metric='docs', level='shards')
+    generation = []
+    for name, index_stats in sorted(stats['indices'].items()):
+        docs = index_stats['primaries']['docs']
+        commits = sorted((shard_id, copy.get('commit', {}).get('generation'))
+                         for shard_id, copies in index_stats['shards'].items()
+                         for copy in copies
+                         if copy.get('routing', {}).get('primary'))
+        generation.append([name, docs['count'], docs['deleted'], commits])
+    return json.dumps(generation)
+
+
+class ResultCache(object):
+    """ Caches hits as compact (ids, scores) per search
+
+    :filename: the sqlite file holding the results
+    :client: the elasticsearch client, the shared one by default
+    """
+
+    def __init__(self, filename, client=None):
+        self.client = client if client is not None else clients.get_client()
+        self._db = sqlite3.connect(filename)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                         "(key TEXT PRIMARY KEY, idx TEXT, generation TEXT,"
+                         " ids TEXT, scores BLOB)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_idx "
+                         "ON results (idx)")
+        # index => generation, checked once per cache object
+        self._generations = {}
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def generation(self, index):
+        """ Returns the generation of index and drops the entries of other
+        generations """
+        if index not in self._generations:
+            generation = index_generation(self.client, index)
+            self._db.execute("DELETE FROM results WHERE idx = ? AND"
+                             " generation != ?", (index, generation))
+            self._db.commit()
+            self._generations[index] = generation
+        return self._generations[index]
+
+    @staticmethod
+    def key(index, doc_type, size, strategy, query):
+        """ Key of a search of query with strategy """
+        text = json.dumps([index, doc_type, size, strategy.template_id(),
+                           query])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ Returns the cached hits of key as LeanHits, or None """
+        row = self._db.execute("SELECT ids, scores FROM results WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        ids = row[0].split('\n') if row[0] else []
+        scores = array('d')
+        scores.frombytes(row[1])
+        return utils.LeanHits(ids, scores, len(ids))
+
+    def put(self, key, index, response):
+        """ Stores the ids and scores of the hits of a search response (or
+        LeanHits) under key and returns them like get """
+        if not isinstance(response, utils.LeanHits):
+            response = utils.LeanHits(
+                [hit.meta.id for hit in response],
+                array('d', [hit.meta.score or 0. for hit in response]),
+                response.hits.total)
+        self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                         (key, index, self.generation(index),
+                          '\n'.join(response.ids), response.scores.tobytes()))
+        return response
+
+    def execute_fanout(self, queries, targets, **kwargs):
+        """ Like utils.execute_fanout, but only the searches that are not
+        cached are sent, lean by default. Returns the hits as LeanHits. """
+        queries = list(queries)
+        keys, results = [], []
+        for index, strategy, doc_type, size in targets:
+            index = index or strategy.get_index()
+            self.generation(index)
+            keys.append([self.key(index, doc_type, size, strategy, query)
+                         for query in queries])
+            results.append([self.get(key) for key in keys[-1]])
+        missing = set((tid, qid) for tid, hits in enumerate(results)
+                      for qid, cached in enumerate(hits) if cached is None)
+        self.n_hits += len(targets) * len(queries) - len(missing)
+        self.n_misses += len(missing)
+        if missing:
+            kwargs.setdefault('lean', True)
+            fetched = utils.execute_fanout(queries, targets, only=missing,
+                                           **kwargs)
+            for tid, qid in missing:
+                index = targets[tid][0] or targets[tid][1].get_index()
+                results[tid][qid] = self.put(keys[tid][qid], index,
+                                             fetched[tid][qid])
+            self._db.commit()
+        return results
+
+    def close(self):
+        """ Commits and closes the store """
+        self._db.commit()
+        self._db.close()
+
+    def report(self):
+        """ Returns a summary of the cache use """
+        return ("%d searches from the cache, %d sent to elasticsearch"
+                % (self.n_hits, self.n_misses))
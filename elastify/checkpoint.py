@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Checkpoints for resumable elastify runs.
+Every document (a file, or a line in line mode) gets a sequence number in walk
+order. The checkpoint keeps the position up to which all documents have been
+acknowledged by elasticsearch, the few documents beyond it that are still
+unacknowledged and the documents that failed. It only changes when a bulk
+response arrives, so a resumed run skips exactly what elasticsearch confirmed.
+A hash of the walk, the kind, path and line (or member) of every document,
+identifies the listing the sequence numbers refer to: a run over a changed
+listing is not resumed.
+"""
+from __future__ import print_function
+from collections import deque
+from threading import Lock
+from timeit import default_timer
+
+import hashlib
+import json
+import os
+
+
+class Checkpoint(object):
+    """ Keeps track of acknowledged documents and persists them to filename
+
+    :filename: the checkpoint file
+    :source: the path that is ingested
+    :index: the index it is ingested into
+    :interval: seconds between two saves
+    """
+
+    def __init__(self, filename, source, index, interval=5):
+        self.filename = filename
+        self.source = os.path.abspath(source)
+        self.index = index
+        self.interval = interval
+        # all documents before position are acknowledged (or failed)
+        self.position = 0
+        # highest sequence number seen so far
+        self.last = -1
+        # documents of the previous run that were not acknowledged
+        self.unsettled = set()
+        self.failed = set()
+        # sequence number => number of unacknowledged items, and the
+        # pending sequence numbers in the (ascending) order they were tracked
+        self._pending = {}
+        self._order = deque()
+        self._lock = Lock()
+        self._saved = default_timer()
+        # hash of the first n_listed documents of the walk, and the length
+        # and hash of the listing of the previous run, until it is checked
+        self._listing = hashlib.sha1()
+        self.n_listed = 0
+        self.resumed = None
+
+    def load(self):
+        """ Loads the checkpoint of a previous run, if any, to resume it.
+        Raises ValueError if it is one of another source or index. """
+        if not os.path.isfile(self.filename):
+            return self
+        with open(self.filename, 'r') as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state['source'] != self.source or state['index'] != self.index:
+            raise ValueError("Checkpoint %s belongs to %s in %s"
+                             % (self.filename, state['source'],
+                                state['index']))
+        self.resumed = (state.get('n_listed'), state.get('listing'))
+        self.position = state['position']
+        self.last = state['last']
+        self.unsettled = set(state['unsettled'])
+        self.failed = set(state['failed'])
+        return self
+
+    def save(self):
+        """ Atomically writes the current state to the checkpoint file """
+        with self._lock:
+            state = {'source': self.source,
+                     'index': self.index,
+                     'n_listed': self.n_listed,
+                     'listing': self._listing.hexdigest(),
+                     'position': self.position,
+                     'last': self.last,
+                     'unsettled': sorted(self.unsettled | set(self._pending)),
+                     'failed': sorted(self.failed)}
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.replace(tmpname, self.filename)
+        self._saved = default_timer()
+
+    def done(self, seq):
+        """ True if document seq was acknowledged in a previous run """
+        if seq in self.failed or seq in self.unsettled:
+            return False
+        return seq <= self.last
+
+    @staticmethod
+    def _walk(listing, unit):
+        """ Adds a document of the walk to the listing hash """
+        key = [unit[0], os.path.abspath(unit[1])] + list(unit[2:3])
+        listing.update(json.dumps(key, default=str).encode('utf-8'))
+        listing.update(b'\n')
+
+    def check(self, units):
+        """ Walks (seq, unit) pairs as far as the run of the loaded checkpoint
+        did and raises ValueError unless they are the same documents """
+        if self.resumed is None:
+            return
+        n_listed, listing = self.resumed
+        walked = hashlib.sha1()
+        n_walked = 0
+        for _, unit in units:
+            if n_walked == n_listed:
+                break
+            self._walk(walked, unit)
+            n_walked += 1
+        if (n_walked, walked.hexdigest()) != (n_listed, listing):
+            raise ValueError("The documents in %s changed since checkpoint %s"
+                             " was written, run without --resume"
+                             % (self.source, self.filename))
+        self.resumed = None
+
+    def skip(self, units):
+        """ Filters (seq, unit) pairs, dropping the acknowledged ones. On a
+        resume, check the units first. """
+        for seq, unit in units:
+            with self._lock:
+                self._walk(self._listing, unit)
+                self.n_listed += 1
+            if not self.done(seq):
+                yield seq, unit
+
+    def track(self, items):
+        """ Registers serialised items, tagged with the sequence number of
+        their document, before they are sent. Items without a sequence number
+        are not tracked. """
+        for item in items:
+            seq = item[2]
+            if seq is None:
+                yield item
+                continue
+            with self._lock:
+                if seq not in self._pending:
+                    self._pending[seq] = 0
+                    self._order.append(seq)
+                    # a retry of a failed document, it is judged anew
+                    self.failed.discard(seq)
+                self._pending[seq] += 1
+                self.last = max(self.last, seq)
+            yield item
+
+    def ack(self, seq, success):
+        """ Records the bulk response for one item of document seq """
+        if seq is None:
+            return
+        with self._lock:
+            if not success:
+                self.failed.add(seq)
+            self._pending[seq] -= 1
+            if not self._pending[seq]:
+                del self._pending[seq]
+                self.unsettled.discard(seq)
+            while self._order and self._order[0] not in self._pending:
+                self._order.popleft()
+            # documents without items (e.g. empty lines) are never pending
+            position = self._order[0] if self._order else self.last + 1
+            self.position = max(self.position, position)
+        if default_timer() - self._saved > self.interval:
+            self.save()
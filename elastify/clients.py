@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Clients -- one lazily created elasticsearch client shared by all tools.
+Importing a module does not connect anywhere: the client is built on its
+first use, from settings taken from the environment (ELASTIFY_HOSTS,
+ELASTIFY_TIMEOUT, ELASTIFY_MAXSIZE, ELASTIFY_COMPRESS, ELASTIFY_SNIFF) and
+the command line (see add_arguments). The client keeps its connections alive
+in a pool of maxsize connections per host and is safe to share between
+threads; a forked process builds its own.
+
+    ES = clients.LazyClient()   # costs nothing
+    ES.indices.exists('economics')   # connects
+"""
+from __future__ import print_function
+from threading import Lock
+
+import gzip
+import os
+
+from elasticsearch import Elasticsearch
+from elasticsearch.connection import Urllib3HttpConnection
+import urllib3
+
+DEFAULTS = {'hosts': 'localhost:9200', 'timeout': 3600., 'maxsize': 10,
+            'compress': False, 'sniff': False}
+
+_settings = dict(DEFAULTS)
+_client = None
+_pid = None
+_lock = Lock()
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _from_env():
+    """ Settings from ELASTIFY_* environment variables """
+    settings = {}
+    for key, convert in (('hosts', str), ('timeout', float), ('maxsize', int),
+                         ('compress', _flag), ('sniff', _flag)):
+        value = os.environ.get('ELASTIFY_' + key.upper())
+        if value:
+            settings[key] = convert(value)
+    return settings
+
+
+_settings.update(_from_env())
+
+
+class CompressedConnection(Urllib3HttpConnection):
+    """ Gzips request bodies and accepts gzipped responses, which
+    elasticsearch-py 5 does not offer on its own """
+
+    def __init__(self, *args, **kwargs):
+        super(CompressedConnection, self).__init__(*args, **kwargs)
+        self.headers.update(urllib3.make_headers(accept_encoding=True))
+        self.headers['content-encoding'] = 'gzip'
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=()):
+        if body is not None:
+            body = gzip.compress(body, compresslevel=1)
+        return super(CompressedConnection, self).perform_request(
+            method, url, params, body, timeout=timeout, ignore=ignore)
+
+    # the base class decodes the body for its log
+    def log_request_success(self, method, full_url, path, body, *args):
+        return super(CompressedConnection, self).log_request_success(
+            method, full_url, path, body and gzip.decompress(body), *args)
+
+    def log_request_fail(self, method, full_url, path, body, *args, **kwargs):
+        return super(CompressedConnection, self).log_request_fail(
+            method, full_url, path, body and gzip.decompress(body), *args,
+            **kwargs)
+
+
+def configure(**settings):
+    """ Updates the settings (hosts, timeout, maxsize, compress, sniff),
+    None values are ignored. A client built before is replaced on its next
+    use. """
+    global _client
+    settings = dict((key, value) for key, value in settings.items()
+                    if value is not None)
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown client settings %s" % ", ".join(unknown))
+    with _lock:
+        if any(_settings[key] != value for key, value in settings.items()):
+            _settings.update(settings)
+            _client = None
+
+
+def add_arguments(parser):
+    """ Adds the connection options to an argparse parser, see
+    configure_from_args """
+    group = parser.add_argument_group("elasticsearch connection")
+    group.add_argument("--hosts", type=str, default=None,
+                       help="Comma separated host:port list [%s or\
+                       $ELASTIFY_HOSTS]" % DEFAULTS['hosts'])
+    group.add_argument("--timeout", type=float, default=None,
+                       help="Request timeout in seconds [%.0f or\
+                       $ELASTIFY_TIMEOUT]" % DEFAULTS['timeout'])
+    group.add_argument("--compress", action="store_true", default=None,
+                       help="Gzip requests and responses [$ELASTIFY_COMPRESS]")
+    group.add_argument("--sniff", action="store_true", default=None,
+                       help="Discover the other nodes of the cluster and\
+                       spread the requests over them [$ELASTIFY_SNIFF]")
+    return group
+
+
+def configure_from_args(args, maxsize=None):
+    """ Configures the client from the options of add_arguments. maxsize
+    should be at least the number of threads sharing the client. """
+    if maxsize is not None:
+        maxsize = max(maxsize, _settings['maxsize'])
+    configure(hosts=args.hosts, timeout=args.timeout, compress=args.compress,
+              sniff=args.sniff, maxsize=maxsize)
+
+
+def get_client():
+    """ Returns the shared client, building it on first use """
+    global _client, _pid
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            hosts = _settings['hosts']
+            if isinstance(hosts, str):
+                hosts = hosts.split(',')
+            kwargs = {'timeout': _settings['timeout'],
+                      'maxsize': _settings['maxsize']}
+            if _settings['compress']:
+                kwargs['connection_class'] = CompressedConnection
+            if _settings['sniff']:
+                kwargs.update(sniff_on_start=True,
+                              sniff_on_connection_fail=True,
+                              sniffer_timeout=60)
+            _client = Elasticsearch(hosts, **kwargs)
+            _pid = os.getpid()
+        return _client
+
+
+class LazyClient(object):
+    """ Stands in for the shared client until it is used; every attribute is
+    looked up on get_client() """
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __repr__(self):
+        return "<LazyClient %s>" % _settings['hosts']
@@ -6,13 +6,42 @@ Convenient script for adding either plain files to an elasticsearch index
 or adding lines from a single file to the elasticsearch index.
 """
 from __future__ import print_function
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch.serializer import JSONSerializer
+from collections import deque
+from itertools import groupby, islice
+from multiprocessing import Pool
 from timeit import default_timer
 
 import argparse
+import copy
+import gzip
+import heapq
 import json
 import os
-ES = Elasticsearch([{'host': 'localhost'}], timeout=3600)
+import sys
+import tarfile
+import time
+import zipfile
+
+try:
+    import elastify.bulk as bulk
+    import elastify.clients as clients
+    import elastify.indices as indices
+    from elastify.checkpoint import Checkpoint
+    from elastify.fingerprints import FingerprintStore
+    from elastify.telemetry import Telemetry
+except ImportError:
+    import bulk
+    import clients
+    import indices
+    from checkpoint import Checkpoint
+    from fingerprints import FingerprintStore
+    from telemetry import Telemetry
+ES = clients.LazyClient()
+
+
+# archives whose members are read one by one
+ARCHIVES = ('.tar', '.tar.gz', '.tgz', '.zip')
 
 
 def name2id(path):
@@ -25,48 +54,485 @@ def name2id(path):
     return identifier, ext
 
 
-def generate_actions(path, index, doc_type, op_type='index',
-                     fieldname='fulltext', force_update=False, extract=None):
-    """ Generate action items to use with elasticsearchs bulk API """
-    def process_file(filehandle):
-        """ Process one file handle. Returns a dict for the action"""
-        _source_or_doc = {'index': '_source', 'update': 'doc'}[op_type]
-        identifier, extension = name2id(filehandle.name)
-        action = {'_op_type': op_type,
-                  '_index': index,
-                  '_type': doc_type,
+def project(document, fields):
+    """ Restricts a json document to fields (if any) """
+    if fields:
+        return {key: value for key, value in document.items()
+                if key in fields}
+    return document
+
+
+def fan_out_target(spec):
+    """ Parses a fan-out target INDEX[:FIELD,FIELD...] to (index, fields) """
+    index, _, fields = spec.partition(':')
+    return index, fields.split(',') if fields else None
+
+
+class ActionBuilder(object):
+    """ Turns files and lines into action dicts for elasticsearchs bulk API.
+
+    In line mode (lines=True, always for .jsonl files), every line of a file
+    is a document of its own. The identifier of a .txt line is taken from
+    column id_column (split by delimiter, the remaining columns are the
+    content) or is the line number if id_column is None. The identifier of a
+    .jsonl line is the value of its id_key (or the line number if id_key is
+    None). Builders are picklable, so they can be shipped to worker
+    processes.
+
+    Every document is sent to index and to each (index, extract) pair of
+    targets (fan-out), json documents restricted to the respective extract
+    fields (all fields if None).
+    """
+
+    def __init__(self, index, doc_type, op_type='index', fieldname='fulltext',
+                 force_update=False, extract=None, lines=False,
+                 id_column=None, id_key='id', delimiter='\t', targets=None):
+        self.index = index
+        self.doc_type = doc_type
+        self.op_type = op_type
+        self.fieldname = str(fieldname)
+        self.force_update = force_update
+        self.extract = extract
+        self.lines = lines
+        self.id_column = id_column
+        self.id_key = id_key
+        self.delimiter = delimiter
+        self.targets = [(index, extract)] + list(targets or [])
+
+    def action(self, identifier, document, index=None):
+        """ Wraps a document into an action dict """
+        action = {'_op_type': self.op_type,
+                  '_index': index or self.index,
+                  '_type': self.doc_type,
                   '_id': identifier}
-        if op_type is 'update':
-            action['doc_as_upsert'] = force_update
+        if self.op_type == 'update':
+            action['doc_as_upsert'] = self.force_update
+        if document is not None:
+            _source_or_doc = {'index': '_source',
+                              'update': 'doc'}[self.op_type]
+            action[_source_or_doc] = document
+        return action
+
+    def actions(self, identifier, document, is_json=False):
+        """ Wraps a document into one action dict per target index. Json
+        documents are restricted to the extract fields of the target. """
+        return [self.action(identifier,
+                            project(document, extract) if is_json
+                            else document, index)
+                for index, extract in self.targets]
+
+    def line_mode(self, filepath):
+        """ True if filepath is to be processed line by line """
+        return self.lines or name2id(filepath)[1] == '.jsonl'
+
+    def from_file(self, filehandle):
+        """ Process one file handle. Returns the actions (one per target) """
+        return self.from_text(filehandle.name, filehandle.read())
+
+    def from_text(self, name, text):
+        """ Process the contents of file name. Returns the actions (one per
+        target) """
+        identifier, extension = name2id(name)
         if extension == '.txt':
-            action[_source_or_doc] = {str(fieldname): filehandle.read()}
+            return self.actions(identifier, {self.fieldname: text})
         elif extension == '.json':
-            # TODO: we could restrict json input to certain fields here
-            _full_dict = dict(json.load(filehandle))
-            if extract:
-                action[_source_or_doc] = {key : value for key,value in
-                                          _full_dict.items() if key in extract}
+            return self.actions(identifier, dict(json.loads(text)),
+                                is_json=True)
+        return self.actions(identifier, None)
+
+    def from_lines(self, name, lines, start=1):
+        """ Process the lines of file name, the first one being line number
+        start. Yields the actions (one per target) of each non-empty line.
+        Malformed lines are reported and skipped. """
+        _, extension = name2id(name)
+        for lineno, line in enumerate(lines, start=start):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            try:
+                identifier, document = self.parse_line(line, lineno,
+                                                       extension)
+            except (ValueError, TypeError) as error:
+                print("[elastify] Warning: skipping %s:%d, %s"
+                      % (name, lineno, error), file=sys.stderr)
+                continue
+            for action in self.actions(identifier, document,
+                                       is_json=extension == '.jsonl'):
+                yield action
+
+    def parse_line(self, line, lineno, extension):
+        """ Returns the id and the document of one line, raises ValueError
+        (or TypeError) if it is malformed """
+        if extension == '.jsonl':
+            # the id is read before the document is projected
+            document = dict(json.loads(line))
+            if self.id_key is None:
+                return str(lineno), document
+            try:
+                return str(document[self.id_key]), document
+            except KeyError:
+                raise ValueError("no key '%s'" % self.id_key)
+        if self.id_column is None:
+            return str(lineno), {self.fieldname: line}
+        columns = line.split(self.delimiter)
+        try:
+            identifier = columns.pop(self.id_column)
+        except IndexError:
+            raise ValueError("no column %d" % self.id_column)
+        return identifier, {self.fieldname: self.delimiter.join(columns)}
+
+    def from_join(self, identifier, parts):
+        """ Merges the (path, field) parts of a document (see join_units)
+        into one. Returns the actions (one per target) """
+        document = {}
+        for path, field in parts:
+            with open(path, 'r') as filehandle:
+                if name2id(path)[1] == '.json':
+                    content = json.load(filehandle)
+                    if not field:
+                        document.update(content)
+                        continue
+                else:
+                    content = filehandle.read()
+            document[field or self.fieldname] = content
+        return self.actions(identifier, document, is_json=True)
+
+    def from_unit(self, unit):
+        """ Process one unit of work of generate_units (or join_units) """
+        if unit[0] == 'file':
+            return self.from_path(unit[1])
+        if unit[0] == 'join':
+            _, _, identifier, parts = unit
+            return self.from_join(identifier, parts)
+        if unit[0] == 'member':
+            _, _, name, text = unit
+            return self.from_text(name, text)
+        _, _, lineno, line, name = unit
+        return self.from_lines(name, [line], start=lineno)
+
+    def from_path(self, filepath):
+        """ Dispatches a file to either from_lines or from_file """
+        with open(filepath, 'r') as filehandle:
+            if self.line_mode(filepath):
+                for action in self.from_lines(filepath, filehandle):
+                    yield action
             else:
-                action[_source_or_doc] = _full_dict
+                for action in self.from_file(filehandle):
+                    yield action
 
-        return action
 
+def walk(path):
+    """ Yields the files below path (or path itself if it is a file) in a
+    stable order """
     if os.path.isdir(path):
-        for dirpath, _, filenames in os.walk(path):
-            for filename in filenames:
-                with open(os.path.join(dirpath, filename), 'r') as filehandle:
-                    yield process_file(filehandle)
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield os.path.join(dirpath, filename)
     elif os.path.isfile(path):
-        with open(path, 'r') as filehandle:
-            yield process_file(filehandle)
+        yield path
     else:
         raise ValueError
 
 
+def generate_actions(path, index, doc_type, op_type='index',
+                     fieldname='fulltext', force_update=False, extract=None,
+                     lines=False, id_column=None, id_key='id',
+                     delimiter='\t'):
+    """ Generate action items to use with elasticsearchs bulk API
+    (see ActionBuilder for the line mode options). Lines are read lazily, so
+    memory does not grow with the file. """
+    builder = ActionBuilder(index, doc_type, op_type=op_type,
+                            fieldname=fieldname, force_update=force_update,
+                            extract=extract, lines=lines, id_column=id_column,
+                            id_key=id_key, delimiter=delimiter)
+    for unit in generate_units(path, builder):
+        for action in builder.from_unit(unit):
+            yield action
+
+
+def is_archive(path):
+    """ True if path is an archive or a compressed file elastify reads """
+    return path.endswith(ARCHIVES + ('.gz',))
+
+
+def archive_members(path):
+    """ Yields (name, binary file object) for the regular files in a .tar,
+    .tar.gz, .tgz or .zip archive, or the single file of a .gz file, without
+    unpacking them to disk. """
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith('/'):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+    elif path.endswith(ARCHIVES):
+        # stream mode, members are read in the order they are stored
+        with tarfile.open(path, 'r|*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+    else:
+        with gzip.open(path, 'rb') as member:
+            # 0011.json.gz => 0011.json
+            yield os.path.splitext(path)[0], member
+
+
+def generate_units(path, builder):
+    """ Walks path and yields one unit of work per document. That is
+    ('file', path) for plain files, ('member', path, name, text) for files in
+    archives and ('line', path, lineno, line, name) for the lines of files in
+    line mode, where name is the file's name in the archive (or path). Only
+    archives and lines are read here, files are left to
+    ActionBuilder.from_unit. """
+    for filepath in walk(path):
+        if is_archive(filepath):
+            for name, member in archive_members(filepath):
+                if builder.line_mode(name):
+                    for lineno, line in enumerate(member, start=1):
+                        yield ('line', filepath, lineno, line.decode('utf-8'),
+                               name)
+                else:
+                    yield ('member', filepath, name,
+                           member.read().decode('utf-8'))
+        elif builder.line_mode(filepath):
+            with open(filepath, 'r') as filehandle:
+                for lineno, line in enumerate(filehandle, start=1):
+                    yield ('line', filepath, lineno, line, filepath)
+        else:
+            yield ('file', filepath)
+
+
+def raw_units(path):
+    """ Walks path for files in elasticsearch's bulk format (an action line,
+    followed by a source line unless it is a delete) and yields one
+    ('raw', path, lineno, action_line, data_line) unit per action. The lines
+    are bytes and only the action lines are decoded. .gz files are read
+    without unpacking them. """
+    for filepath in walk(path):
+        opener = gzip.open if filepath.endswith('.gz') else open
+        with opener(filepath, 'rb') as bulk_file:
+            lines = enumerate(bulk_file, start=1)
+            for lineno, action_line in lines:
+                action_line = action_line.rstrip(b'\r\n')
+                if not action_line.strip():
+                    continue
+                data_line = None
+                if 'delete' not in json.loads(action_line.decode('utf-8')):
+                    try:
+                        data_line = next(lines)[1].rstrip(b'\r\n')
+                    except StopIteration:
+                        raise ValueError("%s:%d has no source line"
+                                         % (filepath, lineno))
+                yield ('raw', filepath, lineno, action_line, data_line)
+
+
+def raw_items(units, index=None):
+    """ Turns (seq, unit) pairs of raw_units into items tagged with seq.
+    If index is given, it replaces the index of every action line; the
+    source lines are passed through untouched. """
+    for seq, (_, _, _, action_line, data_line) in units:
+        if index:
+            action = json.loads(action_line.decode('utf-8'))
+            list(action.values())[0]['_index'] = index
+            action_line = json.dumps(action).encode('utf-8')
+        yield action_line, data_line, seq
+
+
+def join_spec(spec):
+    """ Parses a join spec DIR%EXT[:FIELD] to (dir, ext, field), ext with its
+    leading dot """
+    path, _, ext = spec.rpartition('%')
+    ext, _, field = ext.partition(':')
+    if not path or not ext.strip('.'):
+        raise argparse.ArgumentTypeError("%s is not of the form DIR%%EXT:FIELD"
+                                         % spec)
+    return os.path.normpath(path), '.' + ext.lstrip('.'), field or None
+
+
+def _listing(path, ext, number):
+    """ (identifier, number, filename) for the files of path with extension
+    ext, sorted by identifier """
+    entries = []
+    for filename in os.listdir(path):
+        identifier, suffix = os.path.splitext(filename)
+        if suffix == ext:
+            entries.append((identifier, number, filename))
+    entries.sort()
+    return entries
+
+
+def join_units(specs, stats=None):
+    """ Merges the directories of specs ((dir, ext, field), see join_spec) by
+    identifier, like cutset does, and yields one
+    ('join', path, identifier, [(path, field), ...]) unit per identifier found
+    in all of them, path being its file in the first directory. The sorted
+    listings are merged in one pass, without building sets of identifiers.
+    stats, if given, counts the 'joined' and 'incomplete' identifiers. """
+    listings = [_listing(path, ext, number)
+                for number, (path, ext, _) in enumerate(specs)]
+    stats = stats if stats is not None else {}
+    stats.setdefault('joined', 0)
+    stats.setdefault('incomplete', 0)
+    for identifier, group in groupby(heapq.merge(*listings),
+                                     key=lambda entry: entry[0]):
+        group = list(group)
+        if len(group) < len(specs):
+            stats['incomplete'] += 1
+            continue
+        stats['joined'] += 1
+        parts = [(os.path.join(specs[number][0], filename),
+                  specs[number][2])
+                 for _, number, filename in group]
+        yield ('join', parts[0][0], identifier, parts)
+
+
+def serialize_units(builder, units, serializer):
+    """ Turns (seq, unit) pairs into serialised items tagged with seq """
+    for seq, unit in units:
+        for item in bulk.serialize(builder.from_unit(unit), serializer,
+                                   tag=seq):
+            yield item
+
+
+# worker process state, set up by _init_worker
+_BUILDER = None
+
+
+def _init_worker(builder):
+    """ Stores the builder in a worker process """
+    global _BUILDER
+    _BUILDER = builder
+
+
+def _serialize_batch(batch):
+    """ Reads, decodes, projects and serialises one batch of (seq, unit)
+    pairs in a worker process. Returns a list of serialised items. """
+    return list(serialize_units(_BUILDER, batch, JSONSerializer()))
+
+
+def pooled_items(units, builder, processes, batch_size=1000, queue_size=4):
+    """ Decodes and serialises (seq, unit) pairs in a pool of processes
+    worker processes. Yields serialised items in the order of units, with at
+    most queue_size batches in flight, so a slow consumer stalls the workers
+    instead of piling up their results. """
+    units = iter(units)
+    pending = deque()
+    pool = Pool(processes, initializer=_init_worker, initargs=(builder,))
+    try:
+        for batch in iter(lambda: list(islice(units, batch_size)), []):
+            pending.append(pool.apply_async(_serialize_batch, (batch,)))
+            if len(pending) >= max(queue_size, processes):
+                for item in pending.popleft().get():
+                    yield item
+        while pending:
+            for item in pending.popleft().get():
+                yield item
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _pop_setting(settings, key, default):
+    """ Removes key from flat or nested ('index') index settings, returns its
+    value or default """
+    value = settings.get('index', {}).pop(key, None)
+    value = settings.pop(key, value)
+    return default if value is None else value
+
+
+def create_build_index(client, index, index_settings):
+    """ Creates index from index_settings (as read by indices.load_settings),
+    but without replicas and refreshes, for bulk loading. Returns the number
+    of replicas and the refresh interval to restore afterwards. """
+    body = copy.deepcopy(index_settings) or {}
+    settings = body.setdefault('settings', {})
+    replicas = _pop_setting(settings, 'number_of_replicas', 1)
+    refresh = _pop_setting(settings, 'refresh_interval', '1s')
+    settings.setdefault('index', {}).update({'number_of_replicas': 0,
+                                             'refresh_interval': '-1'})
+    client.indices.create(index=index, body=body)
+    return replicas, refresh
+
+
+def finish_build(client, index, alias, replicas, refresh, segments=1):
+    """ Force merges a freshly built index, restores its replicas and refresh
+    interval, warms it and atomically moves alias to it """
+    print("[elastify] Merging %s to %d segments..." % (index, segments))
+    client.indices.forcemerge(index=index, max_num_segments=segments,
+                              request_timeout=3600)
+    client.indices.put_settings(index=index,
+                                body={"index": {"number_of_replicas": replicas,
+                                                "refresh_interval": refresh}})
+    health = client.cluster.health(index=index, wait_for_status='green',
+                                   timeout='30m', request_timeout=3600)
+    if health['timed_out']:
+        print("[elastify] Warning: %s is %s, replicas are not allocated yet."
+              % (index, health['status']))
+    # warm up the searchers before any query hits them
+    client.indices.refresh(index=index)
+    client.search(index=index, body={"query": {"match_all": {}}}, size=0)
+    indices.move_alias(alias, index)
+    print("[elastify] Alias %s points to %s now. Roll back with\
+ 'indices alias %s <index>'." % (alias, index, alias))
+
+
+def replay(argv=None):
+    """ Re-submits the documents of a dead letter file. The documents that
+    still fail replace the contents of the dead letter file. """
+    parser = argparse.ArgumentParser(prog="elastify replay")
+    parser.add_argument("dead_letter",
+                        help="Dead letter file written by elastify")
+    parser.add_argument("-i", "--index", type=str, default=None,
+                        help="Send the documents to this index instead of the\
+                        one they failed in")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of jobs for parallel execution")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        dest="chunk_size",
+                        help="Initial number of documents per bulk request\
+                        [1000]")
+    parser.add_argument("--max-retries", type=int, default=8,
+                        dest="max_retries",
+                        help="Retries of rejected documents before they\
+                        count as failed [8]")
+    clients.add_arguments(parser)
+    args = parser.parse_args(argv)
+    clients.configure_from_args(args, maxsize=args.jobs)
+
+    items = bulk.read_dead_letters(args.dead_letter, ES.transport.serializer,
+                                   index=args.index)
+    sizer = bulk.BulkSizer(chunk_size=args.chunk_size)
+    telemetry = Telemetry()
+    # the remaining failures are collected aside while the file is read
+    dead_letters = bulk.DeadLetters(args.dead_letter + ".tmp", mode='w')
+    for success, result, item in bulk.adaptive_bulk(
+            ES, items, sizer, thread_count=args.jobs,
+            max_retries=args.max_retries, telemetry=telemetry):
+        if not success:
+            dead_letters.write(item, result)
+        telemetry.result(success)
+    telemetry.report()
+    dead_letters.close()
+    print()
+    print("[elastify]", telemetry.summary())
+    if dead_letters.count:
+        os.replace(dead_letters.filename, args.dead_letter)
+        print("[elastify] %d documents still failed, see %s"
+              % (dead_letters.count, args.dead_letter))
+    else:
+        os.remove(args.dead_letter)
+        print("[elastify] Replayed all documents, removed %s"
+              % args.dead_letter)
+
+
 def main():
     """ Parses command line arguments and either performs indexing or
-    partial doc update operations
+    partial doc update operations. 'elastify replay' re-submits the
+    documents of a dead letter file (see replay).
     """
+    if sys.argv[1:2] == ['replay']:
+        return replay(sys.argv[2:])
     parser = argparse.ArgumentParser()
     parser.add_argument("index", help="Elasticsearch index [economics, ...]")
     parser.add_argument(
@@ -75,7 +541,18 @@ def main():
     parser.add_argument(
         "path",
         type=str,
-        help="Path to data directory containing either .txt or .json files")
+        nargs="?",
+        help="Path to data directory containing either .txt or .json files,\
+        or to a single file (see --lines). Archives (.tar, .tar.gz, .tgz, .zip)\
+        and .gz files are read without unpacking them")
+    parser.add_argument("--join", type=join_spec, nargs="+", default=None,
+                        metavar="DIR%EXT:FIELD",
+                        help="Instead of path, join the files of these\
+                        directories by identifier into one document each, e.g.\
+                        titles/%%.txt:title fulltext/%%.txt:fulltext. The\
+                        content of .txt files goes to FIELD, .json files are\
+                        merged into the document (or put into FIELD). Only\
+                        identifiers present in all directories are sent")
     parser.add_argument("-u", "--update", action="store_true", default=False,
                         help="Performs update instead of index operations")
     parser.add_argument("-f", "--field", type=str, default="fulltext",
@@ -87,68 +564,274 @@ def main():
                         nargs='+',
                         default=None,
                         help="Extract these fields from json files")
+    parser.add_argument("-l", "--lines", action="store_true", default=False,
+                        help="Line mode: index each line of a file as a\
+                        document (implied for .jsonl files)")
+    parser.add_argument("--id-column", type=int, default=None,
+                        dest="id_column",
+                        help="Line mode: column of .txt lines holding the\
+                        identifier, defaults to the line number")
+    parser.add_argument("--id-key", type=str, default="id", dest="id_key",
+                        help="Line mode: key of .jsonl lines holding the\
+                        identifier, defaults to 'id'")
+    parser.add_argument("--delimiter", type=str, default="\t",
+                        help="Line mode: column delimiter of .txt lines,\
+                        defaults to tab")
     parser.add_argument(
         "-j",
         "--jobs",
         type=int,
         default=1,
         help="Number of jobs for parallel execution")
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=0,
+        help="Number of worker processes for reading, decoding and\
+        serialising documents, 0 does it in the main process [0]")
+    parser.add_argument("--fan-out", type=fan_out_target, default=[],
+                        action="append", metavar="INDEX[:FIELD,...]",
+                        help="Also send every document to INDEX, json\
+                        documents restricted to the given fields. May be\
+                        repeated, the corpus is read only once")
+    parser.add_argument("--raw", action="store_true", default=False,
+                        help="The files are in bulk format already (action\
+                        and source lines), pass them through as they are.\
+                        Actions without _index or _type go to index and\
+                        doc_type")
+    parser.add_argument("--rewrite-index", action="store_true", default=False,
+                        help="Raw mode: send every action to index,\
+                        whatever its action line says")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        dest="chunk_size",
+                        help="Initial number of documents per bulk request,\
+                        adapted to the cluster's responses [1000]")
+    parser.add_argument("--max-chunk-mb", type=float, default=10,
+                        dest="max_chunk_mb",
+                        help="Initial limit of megabytes per bulk request,\
+                        adapted to the cluster's responses [10]")
+    parser.add_argument("--max-retries", type=int, default=8,
+                        dest="max_retries",
+                        help="Retries of rejected documents before they\
+                        count as failed [8]")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="File to keep track of acknowledged documents\
+                        in, defaults to elastify-<index>.checkpoint")
+    resume_or_incremental = parser.add_mutually_exclusive_group()
+    resume_or_incremental.add_argument(
+        "--resume", action="store_true", default=False,
+        help="Skip the documents the checkpoint file lists as acknowledged by\
+        a previous run")
+    resume_or_incremental.add_argument(
+        "-i", "--incremental", action="store_true", default=False,
+        help="Only send new or changed documents and delete the ones that\
+        disappeared since the last incremental run (see --fingerprints)")
+    parser.add_argument("--fingerprints", type=str, default=None,
+                        help="File to keep the content hashes of the\
+                        documents in, defaults to elastify-<index>.fingerprints")
+    parser.add_argument("--dead-letter", type=str, default=None,
+                        dest="dead_letter",
+                        help="File to write failed documents to, defaults\
+                        to elastify-<index>.failed.ndjson")
+    parser.add_argument("--build", type=str, default=None,
+                        metavar="SETTINGS",
+                        help="Blue/green build: create a fresh index\
+                        <index>_<timestamp> from this settings file (as for\
+                        'indices create'), bulk into it and finally point the\
+                        alias <index> to it")
+    parser.add_argument("--force", action="store_true", default=False,
+                        help="With --build, point the alias to the new index\
+                        even if documents failed")
+    parser.add_argument("--segments", type=int, default=None,
+                        help="Force merge to this many segments after bulking\
+                        [1 for builds]")
+    parser.add_argument("--interval", type=float, default=2.,
+                        help="Seconds between two progress reports [2]")
+    parser.add_argument("--metrics", type=argparse.FileType('a'),
+                        default=None,
+                        help="Append the progress reports as json lines to\
+                        this file")
     parser.add_argument(
         "-v",
         dest="verbose",
         action="count",
         default=0,
         help="Verbosity")
+    clients.add_arguments(parser)
 
+    args = parser.parse_args()
+    # one connection per sender thread
+    clients.configure_from_args(args, maxsize=args.jobs)
     try:
         assert ES.ping()
     except AssertionError:
         print("[elastify] Could not connect to elasticsearch instance")
         exit(1)
-
-    args = parser.parse_args()
-    if not ES.indices.exists(args.index):
+    if bool(args.path) == bool(args.join):
+        parser.error("either path or --join is required")
+    if args.join:
+        if args.raw or args.incremental or args.lines:
+            parser.error("--join works neither with --raw, --incremental\
+ nor --lines")
+        # identifies the run, e.g. for the checkpoint
+        args.path = " ".join("%s%%%s:%s" % (path, ext, field or "")
+                             for path, ext, field in args.join)
+    if args.build:
+        alias = args.index
+        if args.resume or args.incremental:
+            print("[elastify] A build starts a fresh index, it can not be\
+ resumed or incremental.")
+            exit(1)
+        if ES.indices.exists(alias) and \
+                not ES.indices.exists_alias(name=alias):
+            print("[elastify] %s is an index, not an alias. Abort." % alias)
+            exit(1)
+        args.index = "%s_%s" % (alias, time.strftime("%Y%m%d%H%M%S"))
+        print("[elastify] Building %s for alias %s." % (args.index, alias))
+        replicas, refresh = create_build_index(
+            ES, args.index, indices.load_settings(args.build))
+    elif not ES.indices.exists(args.index):
         print("[elastify] Index not found. Please create an index first.")
         exit(1)
+    if args.raw and args.incremental:
+        print("[elastify] Raw mode can not be incremental.")
+        exit(1)
+    if args.fan_out and (args.raw or args.incremental):
+        print("[elastify] Fan-out works neither in raw nor incremental mode.")
+        exit(1)
+    fan_out = [index for index, _ in args.fan_out]
+    for index in fan_out:
+        if not ES.indices.exists(index):
+            print("[elastify] Index %s not found. Please create it first."
+                  % index)
+            exit(1)
 
     op_type = "update" if args.update else "index"
-    print("[elastify] Bulking %s as %s in %s with '%s' using %d jobs..."
-          % (args.path, args.doc_type, args.index, op_type, args.jobs))
+    print("[elastify] Bulking %s as %s in %s with '%s' using %d jobs and %d\
+ processes..." % (args.path, args.doc_type, args.index, op_type, args.jobs,
+                  args.processes))
+
+    if fan_out:
+        print("[elastify] Fanning out to %s." % ", ".join(fan_out))
+
+    builder = ActionBuilder(args.index, args.doc_type, op_type=op_type,
+                            fieldname=args.field, extract=args.extract,
+                            lines=args.lines, id_column=args.id_column,
+                            id_key=args.id_key, delimiter=args.delimiter,
+                            targets=args.fan_out)
+
+    def walk_units(join_stats):
+        """ The (seq, unit) pairs of the run """
+        if args.raw:
+            return enumerate(raw_units(args.path))
+        if args.join:
+            return enumerate(join_units(args.join, join_stats))
+        return enumerate(generate_units(args.path, builder))
+
+    checkpoint = Checkpoint(args.checkpoint or
+                            "elastify-%s.checkpoint" % args.index,
+                            args.path, args.index)
+    if args.resume:
+        # before any setting is changed
+        try:
+            checkpoint.load()
+            checkpoint.check(walk_units({}))
+        except ValueError as error:
+            print("[elastify] %s" % error)
+            exit(1)
+        print("[elastify] Resuming after %d acknowledged documents."
+              % checkpoint.position)
 
     # set refresh time to -1
-    ES.indices.put_settings(index=args.index, body={"refresh_interval": "-1"})
-    actions = generate_actions(args.path, args.index, args.doc_type,
-                               op_type=op_type, fieldname=args.field,
-                               extract=args.extract)
-    bulk = helpers.parallel_bulk(ES, actions,
-                                 thread_count=args.jobs,
-                                 chunk_size=1000,
-                                 raise_on_error=False)
-    n_success, n_fails, fails = 0, 0, []
+    ES.indices.put_settings(index=",".join([args.index] + fan_out),
+                            body={"refresh_interval": "-1"})
+    join_stats = {}
+    units = checkpoint.skip(walk_units(join_stats))
+    if args.incremental:
+        fingerprints = FingerprintStore(args.fingerprints or
+                                        "elastify-%s.fingerprints" % args.index,
+                                        args.index, args.doc_type)
+        units = fingerprints.filter_units(units)
+    if args.raw:
+        # in a build, the action lines have to point to the new index
+        items = raw_items(units, args.index
+                          if args.rewrite_index or args.build else None)
+    elif args.processes:
+        items = pooled_items(units, builder, args.processes)
+    else:
+        items = serialize_units(builder, units, ES.transport.serializer)
+    if args.incremental:
+        items = fingerprints.filter_items(items, ES.transport.serializer)
+    items = checkpoint.track(items)
+    sizer = bulk.BulkSizer(chunk_size=args.chunk_size,
+                           max_chunk_bytes=int(args.max_chunk_mb * 1024 * 1024))
+    telemetry = Telemetry(interval=args.interval, metrics=args.metrics)
+    results = bulk.adaptive_bulk(ES, items, sizer, thread_count=args.jobs,
+                                 max_retries=args.max_retries,
+                                 telemetry=telemetry, index=args.index,
+                                 doc_type=args.doc_type)
+    dead_letters = bulk.DeadLetters(args.dead_letter or
+                                    "elastify-%s.failed.ndjson" % args.index)
     start = default_timer()
-    for success, result in bulk:
-        if success:
-            n_success += 1
-        else:
-            n_fails += 1
-            if args.verbose:
-                fails.append(result[op_type]['error'])
-        print("\r[elastify] %7d succeeded, %7d failed."
-              % (n_success, n_fails), flush=True, end='')
-
-    # set refresh time to 1s
-    ES.indices.put_settings(index=args.index, body={"refresh_interval": "1s"})
-    # assert merging
-    ES.indices.forcemerge(index=args.index)
+    try:
+        for success, result, item in results:
+            checkpoint.ack(item[2], success)
+            if args.incremental:
+                fingerprints.ack(item, success, result)
+            if not success:
+                dead_letters.write(item, result)
+                if args.verbose:
+                    print("\n[elastify]", list(result.values())[0]['error'],
+                          file=sys.stderr)
+            telemetry.result(success)
+        telemetry.report()
+    finally:
+        # keep what was acknowledged, also when the run dies
+        dead_letters.close()
+        checkpoint.save()
+        if args.incremental:
+            fingerprints.close()
+
     print()
-    if args.verbose:
-        print(*fails)
+    # a build with failed documents does not replace the previous index
+    broken_build = args.build and dead_letters.count and not args.force
+    if broken_build:
+        restore = fan_out
+    elif args.build:
+        finish_build(ES, args.index, alias, replicas, refresh,
+                     segments=args.segments or 1)
+        restore = fan_out
+    else:
+        restore = [args.index] + fan_out
+    if restore:
+        # set refresh time to 1s
+        ES.indices.put_settings(index=",".join(restore),
+                                body={"refresh_interval": "1s"})
+        # assert merging
+        ES.indices.forcemerge(index=",".join(restore),
+                              max_num_segments=args.segments)
+    print("[elastify]", telemetry.summary())
+    if dead_letters.count:
+        print("[elastify] Added %d failed documents to %s, see elastify replay"
+              % (dead_letters.count, dead_letters.filename))
+    print("[elastify]", sizer.report())
+    if args.incremental:
+        print("[elastify]", fingerprints.report())
+    if args.join:
+        print("[elastify] Joined %d documents, skipped %d identifiers missing\
+ in some directory." % (join_stats['joined'], join_stats['incomplete']))
     elapsed = default_timer() - start
     minutes, seconds = divmod(elapsed, 60)
     hours, minutes = divmod(minutes, 60)
     print("[elastify] Finished after %d hours,\
             %d minutes and %.0f seconds."
           % (hours, minutes, seconds))
+    if broken_build:
+        print("[elastify] %d documents failed, alias %s was not moved to %s.\
+ Delete it with 'indices delete %s', or build again with --force to move the\
+ alias anyway." % (dead_letters.count, alias, args.index, args.index))
+        exit(1)
 
 if __name__ == '__main__':
     main()
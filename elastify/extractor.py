@@ -6,27 +6,32 @@
 
 from __future__ import print_function
 import argparse
-import yaml
 import os
 import sys
 import json
-from elasticsearch import Elasticsearch
 from collections import deque, defaultdict
 try:
+    import elastify.clients as clients
     from elastify.thesaurus_reader import ThesaurusReader
 except ImportError:
+    import clients
     from thesaurus_reader import ThesaurusReader
 
 
-ES = Elasticsearch(timeout=3600)
+ES = clients.LazyClient()
 
 ES_PREPROCESSOR_INDEX = "tmpthesauruspreprocessor"
 
 
 SETTINGS_PATH = os.path.join(os.path.split(__file__)[0], "thes_prep.yaml")
-print(SETTINGS_PATH)
-with open(SETTINGS_PATH, 'r') as thes_prep_file:
-    ES_PREPROCESSOR_INDEX_SETTINGS = yaml.load(thes_prep_file)
+
+
+def preprocessor_settings():
+    """ Reads the settings of the temporary analysis index, only needed
+    with --analyzer """
+    import yaml
+    with open(SETTINGS_PATH, 'r') as thes_prep_file:
+        return yaml.safe_load(thes_prep_file)
 
 
 def analyze(label, analyzer="ThesaurusPreprocessor"):
@@ -320,7 +325,7 @@ def main():
             ES.indices.delete(ES_PREPROCESSOR_INDEX)
         # FIXME wtf prints 404 here?
         print(ES.indices.create(index=ES_PREPROCESSOR_INDEX,
-                                body=ES_PREPROCESSOR_INDEX_SETTINGS))
+                                body=preprocessor_settings()))
         # ES.cluster.health(wait_for_status='green')
         print("Done.")
 
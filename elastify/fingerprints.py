@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Fingerprints for incremental elastify runs.
+A local sqlite store keeps the content hash, the modification time and the
+source file of every document of an index. An incremental run only sends the
+documents that are new or changed and deletes the ones that disappeared, so
+its cost is proportional to the delta instead of the whole corpus.
+A document only gets the modification time of its file once elasticsearch
+stored it, so a file is only skipped as a whole if all its documents are in.
+"""
+from __future__ import print_function
+from collections import deque
+from threading import Lock
+from timeit import default_timer
+
+import hashlib
+import os
+import sqlite3
+
+
+class FingerprintStore(object):
+    """ Compares documents against the fingerprints of the previous run
+
+    :filename: the sqlite file holding the fingerprints
+    :index: the index the documents are sent to
+    :doc_type: the document type, used for delete actions
+    :interval: seconds between two commits
+    """
+
+    def __init__(self, filename, index, doc_type, interval=5):
+        self.index = index
+        self.doc_type = doc_type
+        self.interval = interval
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS fingerprints "
+                         "(id TEXT PRIMARY KEY, hash TEXT, mtime REAL,"
+                         " path TEXT, run INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS fingerprints_path "
+                         "ON fingerprints (path)")
+        self.run = self._db.execute("SELECT COALESCE(MAX(run), 0) + 1 "
+                                    "FROM fingerprints").fetchone()[0]
+        self._lock = Lock()
+        self._committed = default_timer()
+        # (seq, path, mtime) of the units between filter_units and filter_items
+        self._units = deque()
+        # sequence number (action line for deletes) => (id, hash, mtime, path)
+        # of the items sent
+        self._pending = {}
+        self.n_unchanged = 0
+        self.n_changed = 0
+        self.n_deleted = 0
+
+    def _commit(self, force=False):
+        if force or default_timer() - self._committed > self.interval:
+            self._db.commit()
+            self._committed = default_timer()
+
+    def filter_units(self, units):
+        """ Filters (seq, unit) pairs, dropping the files whose modification
+        time did not change since all their documents were stored. Their
+        documents are marked as seen. """
+        path, mtime, unchanged = None, None, False
+        for seq, unit in units:
+            if unit[1] != path:
+                path = unit[1]
+                mtime = os.stat(path).st_mtime
+                with self._lock:
+                    rows = self._db.execute("SELECT mtime FROM fingerprints "
+                                            "WHERE path = ?",
+                                            (path,)).fetchall()
+                    unchanged = bool(rows) and all(row[0] == mtime
+                                                   for row in rows)
+                    if unchanged:
+                        self.n_unchanged += len(rows)
+                        self._db.execute("UPDATE fingerprints SET run = ? "
+                                         "WHERE path = ?", (self.run, path))
+                        self._commit()
+            if not unchanged:
+                self._units.append((seq, path, mtime))
+                yield seq, unit
+
+    def filter_items(self, items, serializer):
+        """ Filters serialised items, dropping the documents whose content
+        hash did not change, then yields delete items for the documents that
+        were not seen in this run. """
+        for item in items:
+            action_line, data_line, seq = item
+            while self._units[0][0] < seq:
+                self._units.popleft()
+            _, path, mtime = self._units[0]
+            _, action = serializer.loads(action_line).popitem()
+            identifier = action['_id']
+            digest = hashlib.sha1((data_line or '').encode('utf-8')).hexdigest()
+            with self._lock:
+                row = self._db.execute("SELECT hash FROM fingerprints "
+                                       "WHERE id = ?", (identifier,)).fetchone()
+                if row and row[0] == digest:
+                    self._db.execute("UPDATE fingerprints SET run = ?,"
+                                     " mtime = ?, path = ? WHERE id = ?",
+                                     (self.run, mtime, path, identifier))
+                else:
+                    # without a modification time until it is stored, so its
+                    # file is read again if it never is
+                    self._db.execute("INSERT OR REPLACE INTO fingerprints "
+                                     "VALUES (?, NULL, NULL, ?, ?)",
+                                     (identifier, path, self.run))
+                self._commit()
+            if row and row[0] == digest:
+                self.n_unchanged += 1
+                continue
+            self.n_changed += 1
+            self._pending[seq] = identifier, digest, mtime, path
+            yield item
+
+        with self._lock:
+            gone = [row[0] for row in
+                    self._db.execute("SELECT id FROM fingerprints "
+                                     "WHERE run < ?", (self.run,))]
+        for identifier in gone:
+            action_line = serializer.dumps({'delete': {'_index': self.index,
+                                                       '_type': self.doc_type,
+                                                       '_id': identifier}})
+            self._pending[action_line] = identifier, None, None, None
+            yield action_line, None, None
+
+    def ack(self, item, success, result):
+        """ Records the bulk response for one item of filter_items """
+        key = item[0] if item[2] is None else item[2]
+        identifier, digest, mtime, path = self._pending.pop(key)
+        # deleting a document that is not there is fine as well
+        status = list(result.values())[0].get('status')
+        with self._lock:
+            if not success and not (digest is None and status == 404):
+                if digest is not None:
+                    self._db.execute("UPDATE fingerprints SET mtime = NULL "
+                                     "WHERE id = ?", (identifier,))
+                    self._commit()
+                return
+            if digest is None:
+                self.n_deleted += 1
+                self._db.execute("DELETE FROM fingerprints WHERE id = ?",
+                                 (identifier,))
+            else:
+                self._db.execute("INSERT OR REPLACE INTO fingerprints "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (identifier, digest, mtime, path, self.run))
+            self._commit()
+
+    def close(self):
+        """ Commits and closes the store """
+        with self._lock:
+            self._commit(force=True)
+            self._db.close()
+
+    def report(self):
+        """ Returns a summary of the incremental run """
+        return ("%d documents unchanged, %d new or changed, %d deleted"
+                % (self.n_unchanged, self.n_changed, self.n_deleted))
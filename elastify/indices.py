@@ -14,30 +14,136 @@ import time
 import os
 import pprint
 import json
-import yaml
-from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import NotFoundError
+try:
+    import elastify.clients as clients
+except ImportError:
+    import clients
 
-ES = Elasticsearch(timeout=60)
+ES = clients.LazyClient()
 
 DEFAULT_INDEX_BODY = {"settings": {"number_of_shards": 1,
                                    "number_of_replicas": 0}}
 
 
+def load_settings(filename):
+    """ Loads index settings and mappings from a .yaml or .json file """
+    fname, ext = os.path.splitext(filename)
+    with open(filename, 'r') as settings_file:
+        if ext.lower() == ".yaml":
+            import yaml
+            return yaml.safe_load(settings_file)
+        elif ext.lower() == ".json":
+            return json.load(settings_file)
+    raise ValueError("Unrecognized extension of settings file %s" % filename)
+
+
+def move_alias(alias, index):
+    """ Atomically points alias to index (only) """
+    actions = [{"remove": {"index": old, "alias": alias}}
+               for old in ES.indices.get_alias(name=alias, ignore=404)
+               if old not in ("error", "status")]
+    actions.append({"add": {"index": index, "alias": alias}})
+    return ES.indices.update_aliases(body={"actions": actions})
+
+
+def bulk_pressure():
+    """ Returns the queued and the rejected bulk requests of all nodes """
+    queue = rejected = 0
+    for node in ES.nodes.stats(metric='thread_pool')['nodes'].values():
+        # 'bulk' was renamed to 'write' in elasticsearch 6.3
+        pool = node['thread_pool'].get('bulk') or \
+            node['thread_pool'].get('write', {})
+        queue += pool.get('queue', 0)
+        rejected += pool.get('rejected', 0)
+    return queue, rejected
+
+
+def reindex(source, dest, slices=None, requests_per_second=None, poll=5,
+            max_queue=50):
+    """ Copies source into dest on the cluster with a sliced _reindex, no
+    documents go through this client. dest goes without replicas and
+    refreshes while copying. The task is polled every poll seconds and
+    throttled down as soon as bulk requests queue up (more than max_queue)
+    or are rejected, and up again (to requests_per_second, None for no limit)
+    while the cluster keeps up. Returns the response of the reindex task. """
+    if slices is None:
+        # one slice per primary shard parallelises best
+        slices = max(int(settings['settings']['index']['number_of_shards'])
+                     for settings in ES.indices.get_settings(
+                         index=source, name='index.number_of_shards').values())
+    dest_settings = ES.indices.get_settings(index=dest)[dest]['settings']
+    replicas = dest_settings['index'].get('number_of_replicas', 1)
+    refresh = dest_settings['index'].get('refresh_interval', '1s')
+    ES.indices.put_settings(index=dest, body={"index": {
+        "number_of_replicas": 0, "refresh_interval": "-1"}})
+    try:
+        task = ES.reindex(body={"source": {"index": source},
+                                "dest": {"index": dest}},
+                          slices=slices, wait_for_completion=False,
+                          requests_per_second=requests_per_second or -1)
+        task = task['task']
+        print("Reindexing %s into %s with %d slices, task %s"
+              % (source, dest, slices, task))
+        throttle = requests_per_second
+        _, rejected = bulk_pressure()
+        start = time.time()
+        while True:
+            time.sleep(poll)
+            result = ES.tasks.get(task_id=task)
+            status = result['task']['status']
+            done = status['created'] + status['updated'] + status['deleted']
+            print("\r%d / %d documents, %.0f docs/s, throttle %s    "
+                  % (done, status['total'], done / (time.time() - start),
+                     "%.0f docs/s" % throttle if throttle else "none"),
+                  end="", flush=True)
+            if result.get('completed'):
+                print()
+                return result['response']
+            queue, now_rejected = bulk_pressure()
+            overloaded = now_rejected > rejected or queue > max_queue
+            rejected = now_rejected
+            rate = done / (time.time() - start)
+            if overloaded:
+                new_throttle = max(1., (throttle or rate) / 2)
+            elif throttle and throttle != requests_per_second:
+                new_throttle = throttle * 1.5
+                if requests_per_second:
+                    new_throttle = min(new_throttle, requests_per_second)
+                elif new_throttle > 4 * rate:
+                    # far beyond what the copy achieves, lift the throttle
+                    new_throttle = None
+            else:
+                continue
+            throttle = new_throttle
+            ES.reindex_rethrottle(task_id=task,
+                                  requests_per_second=throttle or -1)
+    finally:
+        ES.indices.put_settings(index=dest, body={"index": {
+            "number_of_replicas": replicas, "refresh_interval": refresh}})
+
+
 def main():
     """ Gives information about indices and allows to manipulate them """
     parser = argparse.ArgumentParser()
     parser.add_argument("command", type=str, help="The command to perform",
                         choices=['list', 'info', 'create', 'delete',
                                  'settings', 'mappings', 'monitor', 'analyze',
-                                 'open', 'close'])
+                                 'open', 'close', 'alias', 'reindex'])
     parser.add_argument("index", nargs="?", type=str,
                         help="The index to operate on")
     parser.add_argument("filename", nargs="?", type=str,
                         help="Several commands require an additional argument\
                         such as the filename of the settings to put in command\
                         'set'")
+    parser.add_argument("--slices", type=int, default=None,
+                        help="reindex: number of slices [primary shards]")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="reindex: upper limit of the throttle\
+                        [unlimited]")
+    clients.add_arguments(parser)
     args = parser.parse_args()
+    clients.configure_from_args(args)
 
     # assert connection
     # assert ES.ping()
@@ -49,16 +155,11 @@ def main():
 
     elif cmd == "create":
         if args.filename:
-            fname, ext = os.path.splitext(args.filename)
-            with open(args.filename, 'r') as settings_file:
-                if ext.lower() == ".yaml":
-                    index_settings = yaml.load(settings_file)
-                elif ext.lower() == ".json":
-                    index_settings = json.load(settings_file)
-                    print(index_settings)
-                else:
-                    print("Unrecognized extension of settings file. Abort.")
-                    exit(1)
+            try:
+                index_settings = load_settings(args.filename)
+            except ValueError:
+                print("Unrecognized extension of settings file. Abort.")
+                exit(1)
         else:
             print("Warning: Created index {} without any\
                   mappings!".format(args.index))
@@ -104,6 +205,18 @@ def main():
     elif cmd=="close":
         print(ES.indices.close(index=args.index))
 
+    elif cmd == "alias":
+        # indices alias <alias> <index>, e.g. to roll back a build
+        print(move_alias(args.index, args.filename))
+
+    elif cmd == "reindex":
+        # indices reindex <source> <dest>, dest created with the new mapping
+        response = reindex(args.index, args.filename, slices=args.slices,
+                           requests_per_second=args.requests_per_second)
+        print("Copied %d documents in %.0f s, %d failures."
+              % (response['created'] + response['updated'],
+                 response['took'] / 1000., len(response['failures'])))
+
     elif cmd == "set":
         ES.indices.close(index=args.index)
         with open(args.filename, 'r') as settings_file:
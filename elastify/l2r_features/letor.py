@@ -1,18 +1,21 @@
 from nltk.corpus import stopwords as sw
 from .feat_utils import get_stemmer, StemmerType, get_freq, get_doc_count, get_field_stats, get_term_stats, remove_stopwords
 from .base import Features
-from elasticsearch import Elasticsearch
+try:
+	import elastify.clients as clients
+except ImportError:
+	import clients
 from elasticsearch_dsl import Search, Q
 from collections import Counter
 import math
 
 class LetorFeatures(Features):
 
-	def __init__(self, client=Elasticsearch([{"host": "localhost"}], timeout=3600), ttfs={},
+	def __init__(self, client=None, ttfs={},
 		stemmer=StemmerType.PORTER_STEMMER, index='economics', index_field='title', doc_type='publication',
 		lm_index='economics', lm_index_field='fulltext', lm_doc_type='publication', delta=0.7, mu=2000.0, alpha=0.1):
 		
-		self._client = client
+		self._client = client if client is not None else clients.get_client()
 		self._index = index
 		self._index_field = index_field
 		self._lm_index = lm_index
@@ -9,7 +9,6 @@ import math
 import string
 import sys
 import json
-import gensim
 from collections import Counter
 
 from nltk.corpus import stopwords as sw
@@ -18,16 +17,19 @@ from nltk.stem.lancaster import LancasterStemmer
 from nltk.stem.porter import PorterStemmer
 from nltk.stem.snowball import EnglishStemmer
 
-from elasticsearch import Elasticsearch
+try:
+	import elastify.clients as clients
+except ImportError:
+	import clients
 
 from .base import Features
 from .feat_utils import *
 
 class MKFeatures(Features):
-	def __init__(self, client=Elasticsearch([{"host": "localhost"}], timeout=3600), ttfs={},
+	def __init__(self, client=None, ttfs={},
 				 stemmer=StemmerType.PORTER_STEMMER, index='economics', index_field='title', doc_type='publication',
 				 lm_index='economics', lm_index_field='fulltext', lm_doc_type='publication', mu=10.0):
-		self._client = client
+		self._client = client if client is not None else clients.get_client()
 		self._index = index
 		self._index_field = index_field
 		self._doc_type = doc_type
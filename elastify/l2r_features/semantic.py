@@ -4,7 +4,6 @@ Implementing various feature values for information retrieval from following sou
 - 
 """
 import sys
-import gensim
 from .base import Features
 
 class SemanticFeatures(Features):
@@ -13,6 +12,8 @@ class SemanticFeatures(Features):
 			'word2vec': self._calc_word2vec,
 		#    'esa_cos_sim': self._calc_esa_cos_sim
 		}
+		# gensim takes seconds to import, only load it for the model
+		import gensim
 		try:
 			print('loading pre-trained word2vec model, this may take a while...')
 			self.w2v_model = gensim.models.Word2Vec.load_word2vec_format(w2v_modelfile, binary=True)
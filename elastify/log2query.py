@@ -5,15 +5,13 @@ import os
 import argparse
 import re
 import sys
-from langdetect import detect
 from urllib.parse import unquote
 from os.path import splitext, isdir, isfile
-from joblib import Parallel, delayed
 
 line_regex = re.compile('[(\d\.)]+ - .+? \[(.*?)\] "(.*?)" [\d-]+ [\d-]+ ".*?" "(.*?)"')
 # /Search/Results?lookfor=econstor&type=AllFields&submit=Search
 url_regex = re.compile('/Search/Results\?lookfor="([^"]*)"&type=AllFields.*')
-bot_regex = re.compile('(?i)(bot)|(?i)(spider)|(?i)(slurp)')
+bot_regex = re.compile('(bot)|(spider)|(slurp)', re.IGNORECASE)
 clean_regex = re.compile('[\+]')
 
 
@@ -26,6 +24,9 @@ def process_file(filepath, lang=None, ext='.gz', clean=False):
     HTTP/1.1" 200 39429 "-" "Mozilla/5.0 (compatible; Applebot/0.3;
     +http://www.apple.com/go/applebot)"
     """
+    if lang:
+        # only needed to filter by language
+        from langdetect import detect
     queries = []
     if splitext(filepath)[1] == ext:
         with gzip.open(filepath, 'rt') as filehandle:
@@ -74,6 +75,7 @@ def process_paths(paths, ext='.gz', n_jobs=1, verbose=0, lang=None, clean=False)
                 fps = [os.path.join(dirpath, fn) for fn in filenames]
                 filepaths.extend(fps)
 
+    from joblib import Parallel, delayed
     results = Parallel(n_jobs=n_jobs,
                        verbose=verbose)(delayed(process_file)(fp, lang=lang,
                                                               ext=ext,
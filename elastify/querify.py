@@ -20,10 +20,12 @@ try:
     # compiled as a package
     import elastify.rank_metrics as rm
     import elastify.utils as utils
+    from elastify.cache import ResultCache
 except ImportError:
     # started as plain script
     import rank_metrics as rm
     import utils
+    from cache import ResultCache
 
 
 def join_scores(y_true, y, padding=0, sort=True):
@@ -142,6 +144,44 @@ def print_query_results(results, fname=None):
     fhandle.close()
 
 
+QUOTES = re.compile(r'["\u201c\u201d\u201e]')
+
+
+def normalize_query(query, fold_case=False, strip_quotes=False):
+    """normalize_query
+    Collapses whitespace and optionally case and quotes of a query string
+    :param query:
+    the query string
+    :param fold_case:
+    lower case the query
+    :param strip_quotes:
+    drop double quotes, i.e. phrase markers
+    """
+    if strip_quotes:
+        query = QUOTES.sub(' ', query)
+    if fold_case:
+        query = query.casefold()
+    return ' '.join(query.split())
+
+
+def dedup_queries(querystrings, **normalize):
+    """dedup_queries
+    Keeps each query string once, strings that are equal when normalised (see
+    normalize_query) count as the same query
+    :param querystrings:
+    the query strings, repetitions included
+    :returns:
+    the unique queries as first written, in order of first occurrence, and,
+    for each query string, the position of its unique query
+    """
+    unique, positions, seen = [], [], {}
+    for query in querystrings:
+        key = normalize_query(query, **normalize)
+        if key not in seen:
+            seen[key] = len(unique)
+            unique.append(query)
+        positions.append(seen[key])
+    return unique, positions
 
 
 def _create_parser():
@@ -199,6 +239,22 @@ def _create_parser():
     parser.add_argument('-t', '--timestamp', action='store_true',
                         default=False,
                         help="Drop the timestamp in queries")
+    parser.add_argument('-c', '--cache', type=str, default=None,
+                        help='Keep the retrieved ids and scores in this sqlite\
+                        file and reuse them while the indices are unchanged')
+    parser.add_argument('--no-dedup', action='store_false', default=True,
+                        dest='dedup', help="Search repeated queries once for\
+                        each line instead of once in total")
+    parser.add_argument('--fold-case', action='store_true', default=False,
+                        help="Treat queries differing in case as the same")
+    parser.add_argument('--strip-quotes', action='store_true', default=False,
+                        help="Treat queries differing in double quotes as\
+                        the same")
+    parser.add_argument('-T', '--templates', action='store_true',
+                        default=False, help='Store each strategy as a search\
+                        template and send only template ids and queries')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Number of msearch requests in flight [4]')
     parser.add_argument('-v', '--verbose', action='count', default=0)
     parser.add_argument('-V', '--very-verbose', action='store_true',
                         default=False, dest='very_verbose',
@@ -221,10 +277,12 @@ def main():
     gold_strategy = utils.FIELDS[args.goldstandard]
     k = args.at
     if '_all' in args.strategy:
-        strategies = utils.FIELDS.values()
+        strategies = list(utils.FIELDS.values())
     else:
         strategies = [utils.FIELDS[strategy] for strategy in args.strategy]
     metrics = args.metric
+    cache = ResultCache(args.cache) if args.cache else None
+    execute_fanout = cache.execute_fanout if cache else utils.execute_fanout
 
     try:
         queryfile = open(args.querysource, 'r')
@@ -244,14 +302,29 @@ def main():
         #                                               querystrings,
         #                                               size=gold_count,
         #                                               source=False)]
+        # each distinct query is searched once, its results are repeated for
+        # every line it occurs in, so frequent queries keep their weight
+        if args.dedup:
+            queries, positions = dedup_queries(
+                querystrings, fold_case=args.fold_case,
+                strip_quotes=args.strip_quotes)
+            print("[querify] %d queries, %d distinct"
+                  % (len(querystrings), len(queries)), file=sys.stderr)
+        else:
+            queries, positions = querystrings, range(len(querystrings))
+
+        # the gold standard and all strategies in one pass over the cluster
+        targets = [(args.gold_index, gold_strategy, args.gold_doc_type,
+                    gold_count)]
+        targets.extend((index, strategy, args.doc_type, k)
+                       for strategy in strategies)
+        responses = [[target_responses[i] for i in positions] for
+                     target_responses in execute_fanout(
+                         queries, targets, jobs=args.jobs, lean=True,
+                         template=args.templates)]
         goldstandard = [defaultdict(int, utils.batched(args.batches,
                                                        utils.doc_ids(docs))) for
-                        docs in utils.execute_multisearch(
-                            args.gold_index,
-                            gold_strategy,
-                            querystrings,
-                            size=gold_count,
-                        doc_type=args.gold_doc_type)]
+                        docs in responses[0]]
         # list of dicts [dict] : list index corresponds to query id, dictionary keys correspond to document identifiers
         # [{"gakkai-somethign" : 1}, {"gakkai-eles":1}]
         # defaultdict(int) -> if key not present return 0
@@ -264,12 +337,8 @@ def main():
               (batches: {})".format(gold_count, args.batches), file=sys.stderr)
 
         strategy_results = dict()
-        for strategy in strategies:
-            challenger = [utils.doc_ids(docs) for docs in
-                          utils.execute_multisearch(index, strategy,
-                                                    querystrings,
-                                                    doc_type=args.doc_type,
-                                                    size=k)]
+        for strategy, strategy_responses in zip(strategies, responses[1:]):
+            challenger = [utils.doc_ids(docs) for docs in strategy_responses]
 
             # results holds a dict of results for each metric
             results = perform_comparison(goldstandard, challenger, k,
@@ -319,6 +388,9 @@ def main():
                 items = (doc['_score'], doc['_id'], doc['_source']['title'])
                 print("", *items, file=args.output, sep="| ")
 
+    if cache:
+        print("[querify]", cache.report(), file=sys.stderr)
+        cache.close()
     elapsed = default_timer() - start
     minutes, seconds = divmod(elapsed, 60)
     hours, minutes = divmod(minutes, 60)
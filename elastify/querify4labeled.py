@@ -7,8 +7,6 @@ rels should be in the fourth col in the rels file.
  """
 
 import sys
-import pandas as pd
-import numpy as np
 import decimal
 from functools import reduce
 try:
@@ -21,7 +19,8 @@ except ImportError:
 
 
 def generate_doc_strategy_labels_data(queries, rels_scores, index, strategies,  
-            size=10000, doctype=None, qids=[]):
+            size=10000, doctype=None, qids=[], jobs=8):
+    import pandas as pd
     # index, doctype, prop = index_doctype_prop
 
     #gold_count = sum(batches)
@@ -39,7 +38,8 @@ def generate_doc_strategy_labels_data(queries, rels_scores, index, strategies,
         for qid, docs in enumerate(
                 utils.execute_multi_singlesearch(index, utils.FIELDS[strategy],
                                           queries, size=size,
-                                          doc_type=doctype, test_subject=subjects_test_bool)):
+                                          doc_type=doctype, test_subject=subjects_test_bool,
+                                          jobs=jobs)):
             if subjects_test_bool:
                 new_qid = qids[j]
                 j+=1
@@ -109,14 +109,15 @@ def evaluate_labeled_data (labeled_data, k=20) :
     print (final_scores)
     return final_scores
 
-def generate_qrels_file_for_digital_lib_data(queries, index, relsoutfile, size=10000, doctype=None):
+def generate_qrels_file_for_digital_lib_data(queries, index, relsoutfile, size=10000, doctype=None, jobs=8):
 
+    import pandas as pd
     records = []
     print('generating qrels file from subject field...')
     for qid, docs in enumerate(
             utils.execute_multi_singlesearch(index, utils.Strategy(["subject"], index=index),  #utils.FIELDS["subject"],
                                       queries, size=size,
-                                      doc_type=doctype)):
+                                      doc_type=doctype, jobs=jobs)):
         print(len(docs), "documents found for query number (qrels file generation)", qid)
 
         for doc in docs:
@@ -195,10 +196,13 @@ def main():
     parser.add_argument('-T', '--type', default='l2r', type=str,
                         choices=['txt', 'l2r', 'csv', 'txt_ss'],
                         help='The type of the generated output.')
+    parser.add_argument('-j', '--jobs', default=8, type=int,
+                        help="Number of searches in flight [8]")
     parser.add_argument('-ro', '--relsoutfile',
                         type=argparse.FileType('w'),
                         help="Generate and write rel scores to relsoutfile.")
     args = parser.parse_args()
+    import pandas as pd
     print(args)
     index  = args.index
     strategies = args.strategy
@@ -213,17 +217,17 @@ def main():
         rels = [( {"new_qid": decimal.Decimal(int(relstring.strip().split("\t")[0])), "did": relstring.strip().split("\t")[2],  "gold_rel_score": decimal.Decimal(int(relstring.strip().split("\t")[3]))} ) for relstring in
                args.relfile.readlines()] #ntcir
         rels_scores = pd.DataFrame(rels, columns=["new_qid", "did", "gold_rel_score"])
-        df = generate_doc_strategy_labels_data(queries, rels_scores,  index, strategies, size=size, doctype=doctype)
+        df = generate_doc_strategy_labels_data(queries, rels_scores,  index, strategies, size=size, doctype=doctype, jobs=args.jobs)
                  
     elif "trec" in index:  
         rels = [( {"new_qid": decimal.Decimal(int(relstring.strip().split(" ")[0])), "did": relstring.strip().split(" ")[2],  "gold_rel_score": decimal.Decimal(int(relstring.strip().split(" ")[3]))} ) for relstring in
                args.relfile.readlines()] #trec
         rels_scores = pd.DataFrame(rels, columns=["new_qid", "did", "gold_rel_score"])
-        df = generate_doc_strategy_labels_data(queries, rels_scores,  index, strategies, size=size, doctype=doctype)
+        df = generate_doc_strategy_labels_data(queries, rels_scores,  index, strategies, size=size, doctype=doctype, jobs=args.jobs)
     
     elif "economics" in index or "politics" in index or "pubmed" in index or "bm25" in index:
         if args.relsoutfile is not None:
-            rels_scores = generate_qrels_file_for_digital_lib_data(queries, index, args.relsoutfile, size=size, doctype=doctype)
+            rels_scores = generate_qrels_file_for_digital_lib_data(queries, index, args.relsoutfile, size=size, doctype=doctype, jobs=args.jobs)
         else:
             rels = [( {"new_qid": decimal.Decimal(int(relstring.strip().split(" ")[0])), "did": relstring.strip().split(" ")[1],  "gold_rel_score": decimal.Decimal(int(relstring.strip().split(" ")[2]))} ) for relstring in
                args.relfile.readlines()] 
@@ -240,7 +244,7 @@ def main():
         qids = new_qids
 
         #print ("QIDS ", qids)
-        df = generate_doc_strategy_labels_data(queries, rels_scores, index, strategies, size=size, doctype=doctype, qids=qids)
+        df = generate_doc_strategy_labels_data(queries, rels_scores, index, strategies, size=size, doctype=doctype, qids=qids, jobs=args.jobs)
     
     else: 
         print ('We can not read the relevancy scores file of your index')
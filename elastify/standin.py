@@ -0,0 +1,943 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Standin -- a small in-process elasticsearch for offline benchmarks and tests.
+It speaks the subset of the REST API this package uses (_bulk, _search with
+search_after and scroll, _msearch, search templates, _count, _stats,
+_analyze, _termvectors, _mtermvectors, _field_stats, index
+create/delete/settings, aliases, _reindex, _tasks and _cat/indices) over
+real HTTP, filter_path included, so the clients, serialisation and response
+parsing run unchanged. Latency and errors can be injected, and search scores
+are canned but deterministic.
+
+    with StandIn(latency=0.01) as standin:
+        client = Elasticsearch(standin.hosts)
+
+or, for the command line tools, python3 standin.py --port 9200
+"""
+from __future__ import print_function
+from collections import Counter
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import RLock, Thread
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import argparse
+import gzip
+import heapq
+import json
+import random
+import re
+import time
+import zlib
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class StandInError(Exception):
+    """ An error answered to the client as an elasticsearch error """
+
+    def __init__(self, status, error_type, reason):
+        super(StandInError, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def body(self):
+        error = {"type": self.error_type, "reason": self.reason}
+        return {"error": dict(error, root_cause=[error]),
+                "status": self.status}
+
+
+def tokenize(text):
+    """ Lower cased word tokens of text, as (token, start, end) """
+    return [(m.group().lower(), m.start(), m.end())
+            for m in TOKEN.finditer(text)]
+
+
+def field_text(source, field):
+    """ The text of a (dotted) field in source. Sub fields of a string, like
+    title.TFIDF, are taken as the string itself (multi-fields). """
+    value = source
+    for part in field.split('.'):
+        if isinstance(value, str):
+            break
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    if isinstance(value, list):
+        value = ' '.join(str(v) for v in value)
+    return value if isinstance(value, str) else None
+
+
+def index_settings(settings, defaults=None):
+    """ Index settings nested under 'index' as elasticsearch returns them,
+    given flat (number_of_shards, index.number_of_shards) or nested """
+    nested = dict(defaults or {})
+    nested.update(settings.get('index', {}))
+    for key, value in settings.items():
+        if key != 'index':
+            nested[key[len('index.'):] if key.startswith('index.')
+                   else key] = value
+    return {"index": nested}
+
+
+def query_terms(query):
+    """ All tokens of the string values in a query body """
+    if isinstance(query, dict):
+        return [t for value in query.values() for t in query_terms(value)]
+    if isinstance(query, list):
+        return [t for value in query for t in query_terms(value)]
+    if isinstance(query, str):
+        return [token for token, _, _ in tokenize(query)]
+    return []
+
+
+def render_template(source, params):
+    """ Renders the mustache subset search templates use: {{name}},
+    {{#name}}...{{/name}}, {{^name}}...{{/name}} and
+    {{#toJson}}name{{/toJson}}; values are looked up by dotted names """
+    def lookup(name):
+        value = params
+        for part in name.strip().split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def scalar(value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        # strings are escaped for json, without the quotes
+        return json.dumps(value)[1:-1] if isinstance(value, str) else \
+            str(value)
+
+    source = re.sub(r"\{\{#toJson\}\}(.*?)\{\{/toJson\}\}",
+                    lambda m: json.dumps(lookup(m.group(1))), source)
+    source = re.sub(r"\{\{([#^])\s*([\w.]+)\s*\}\}(.*?)\{\{/\s*\2\s*\}\}",
+                    lambda m: m.group(3) if bool(lookup(m.group(2))) ==
+                    (m.group(1) == '#') else '', source, flags=re.S)
+    return re.sub(r"\{\{\s*([\w.]+)\s*\}\}",
+                  lambda m: scalar(lookup(m.group(1))), source)
+
+
+def filter_path(body, paths):
+    """ The parts of a response body selected by filter_path, a list of
+    dotted paths which may contain * wildcards; None if nothing is left """
+    if isinstance(body, list):
+        kept = [filter_path(value, paths) for value in body]
+        kept = [value for value in kept if value is not None]
+        return kept or None
+    if not isinstance(body, dict):
+        return body
+    kept = {}
+    for key, value in body.items():
+        rest = [path[1:] for path in paths if fnmatch(key, path[0])]
+        if any(not path for path in rest):
+            kept[key] = value
+        elif rest:
+            value = filter_path(value, rest)
+            if value is not None:
+                kept[key] = value
+    return kept or None
+
+
+class StandIn(object):
+    """ Serves a fake elasticsearch on host:port (port 0: any free port)
+
+    :latency: seconds every request is delayed, plus up to jitter seconds
+    :error_rate: probability of a request being answered with error_status
+    :item_error_rate: probability of a bulk item being rejected with 429
+    :max_body_bytes: larger bulk requests are answered with 413, 0 for no limit
+    :synthetic_docs: number of documents searches hit in an empty index
+    :keep_sources: if False, bulked documents are counted but not stored
+    :seed: seed of the error injection
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0., jitter=0.,
+                 error_rate=0., error_status=429, item_error_rate=0.,
+                 max_body_bytes=0, synthetic_docs=1000, keep_sources=True,
+                 seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.item_error_rate = item_error_rate
+        self.max_body_bytes = max_body_bytes
+        self.synthetic_docs = synthetic_docs
+        self.keep_sources = keep_sources
+        self._random = random.Random(seed)
+        self._lock = RLock()
+        # index => {'settings': ..., 'mappings': ..., 'docs': {id: source},
+        #           'count': number of documents}
+        self.indices = {}
+        self.aliases = {}
+        self.requests = Counter()
+        self.tasks = {}
+        # scroll id => (body, index names, from of the next page)
+        self.scrolls = {}
+        # search template id => mustache source
+        self.templates = {}
+        self.n_rejected = 0
+        self._next_id = 0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def hosts(self):
+        """ The hosts argument for Elasticsearch() """
+        return [{"host": self.host, "port": self.port}]
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    def start(self):
+        """ Serves in a background thread """
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    # injection
+
+    def _chance(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                jitter = self._random.random() * self.jitter
+            time.sleep(self.latency + jitter)
+
+    def inject(self):
+        """ Raises the configured error for a fraction of the requests """
+        if self._chance(self.error_rate):
+            self.n_rejected += 1
+            raise StandInError(self.error_status,
+                               "es_rejected_execution_exception",
+                               "injected error")
+
+    # indices
+
+    def create_index(self, name, body=None):
+        body = body or {}
+        with self._lock:
+            if name in self.indices:
+                raise StandInError(400, "index_already_exists_exception",
+                                   "index [%s] already exists" % name)
+            self.indices[name] = {'settings': index_settings(
+                                      body.get('settings', {}),
+                                      {"number_of_shards": "5",
+                                       "number_of_replicas": "1"}),
+                                  'mappings': body.get('mappings', {}),
+                                  'docs': {}, 'count': 0, 'writes': 0}
+            for alias in body.get('aliases', {}):
+                self.aliases.setdefault(alias, set()).add(name)
+
+    def delete_index(self, expression):
+        names = self.resolve(expression)
+        with self._lock:
+            for name in names:
+                del self.indices[name]
+                for members in self.aliases.values():
+                    members.discard(name)
+
+    def resolve(self, expression, must_exist=True):
+        """ Index names of a comma separated list of indices, aliases and
+        wildcards """
+        if not expression or expression in ('_all', '*'):
+            return sorted(self.indices)
+        names = []
+        for part in expression.split(','):
+            if part in self.indices:
+                names.append(part)
+            elif part in self.aliases:
+                names.extend(sorted(self.aliases[part]))
+            elif '*' in part:
+                names.extend(n for n in sorted(self.indices)
+                             if fnmatch(n, part))
+            elif must_exist:
+                raise StandInError(404, "index_not_found_exception",
+                                   "no such index [%s]" % part)
+        return names
+
+    def _write_index(self, name):
+        """ The index a document is written to, created on the fly """
+        if name in self.aliases and len(self.aliases[name]) == 1:
+            name = next(iter(self.aliases[name]))
+        if name not in self.indices:
+            self.create_index(name)
+        return self.indices[name]
+
+    def update_aliases(self, actions):
+        with self._lock:
+            for action in actions:
+                (op, spec), = action.items()
+                indices = spec.get('indices') or [spec['index']]
+                aliases = spec.get('aliases') or [spec['alias']]
+                for index in indices:
+                    for alias in aliases:
+                        if op == 'add':
+                            self.aliases.setdefault(alias, set()).add(index)
+                        else:
+                            self.aliases.get(alias, set()).discard(index)
+            for alias in [a for a, members in self.aliases.items()
+                          if not members]:
+                del self.aliases[alias]
+
+    # documents
+
+    def bulk(self, body, index=None, doc_type=None):
+        if self.max_body_bytes and len(body) > self.max_body_bytes:
+            raise StandInError(413, "content_too_long",
+                               "request of %d bytes exceeds %d"
+                               % (len(body), self.max_body_bytes))
+        lines = body.decode('utf-8').splitlines()
+        items, errors = [], False
+        pos = 0
+        while pos < len(lines):
+            if not lines[pos].strip():
+                pos += 1
+                continue
+            (op, meta), = json.loads(lines[pos]).items()
+            pos += 1
+            source = None
+            if op != 'delete':
+                source = json.loads(lines[pos])
+                pos += 1
+            item = self._bulk_item(op, meta, source, index, doc_type)
+            errors = errors or item['status'] >= 300
+            items.append({op: item})
+        return {"took": 1, "errors": errors, "items": items}
+
+    def _bulk_item(self, op, meta, source, index, doc_type, inject=True):
+        name = meta.get('_index', index)
+        item = {"_index": name, "_type": meta.get('_type', doc_type)}
+        if '_id' in meta:
+            item['_id'] = str(meta['_id'])
+        if inject and self._chance(self.item_error_rate):
+            self.n_rejected += 1
+            error = StandInError(429, "es_rejected_execution_exception",
+                                 "injected rejection")
+            item.update(status=429, error=error.body()['error'])
+            return item
+        with self._lock:
+            if '_id' in meta:
+                identifier = str(meta['_id'])
+            else:
+                identifier = "standin-%d" % self._next_id
+                self._next_id += 1
+            item['_id'] = identifier
+            target = self._write_index(name)
+            docs = target['docs']
+            exists = identifier in docs
+            if op == 'delete':
+                if not exists:
+                    item.update(status=404, result="not_found")
+                    return item
+                del docs[identifier]
+                target['count'] -= 1
+                target['writes'] += 1
+                item.update(status=200, result="deleted")
+                return item
+            if op == 'create' and exists:
+                item.update(status=409, error={
+                    "type": "version_conflict_engine_exception",
+                    "reason": "[%s]: document already exists" % identifier})
+                return item
+            if op == 'update':
+                if not exists:
+                    item.update(status=404, error={
+                        "type": "document_missing_exception",
+                        "reason": "[%s]: document missing" % identifier})
+                    return item
+                merged = dict(docs[identifier] or {})
+                merged.update(source.get('doc', {}))
+                source = merged
+            if not exists:
+                target['count'] += 1
+            target['writes'] += 1
+            docs[identifier] = source if self.keep_sources else None
+            item.update(_version=1, status=200 if exists else 201,
+                        result="updated" if exists else "created")
+        return item
+
+    def _documents(self, names):
+        """ (index, id, source) of all documents in names, synthetic ones for
+        indices without documents """
+        for name in names:
+            docs = self.indices[name]['docs']
+            if docs:
+                for identifier, source in list(docs.items()):
+                    yield name, identifier, source or {}
+            else:
+                for number in range(self.synthetic_docs):
+                    yield name, str(number), {}
+
+    def search(self, names, body, params=None):
+        """ Hits scored by a hash of the query and the document id, restricted
+        to documents sharing a term with the query if any document has text.
+        Any sort is taken as _score desc, _uid asc, which search_after pages
+        through; with a scroll parameter, the rest is kept for scroll. """
+        body = body or {}
+        params = params or {}
+        size = int(params.get('size', body.get('size', 10)))
+        start = int(params.get('from', body.get('from', 0)))
+        query = body.get('query', {"match_all": {}})
+        key = json.dumps(query, sort_keys=True)
+        terms = set(query_terms(query))
+        candidates = []
+        for name, identifier, source in self._documents(names):
+            if terms and source:
+                text = set(t for t, _, _ in tokenize(json.dumps(source)))
+                if not terms & text:
+                    continue
+            score = 1. + (zlib.crc32(("%s\0%s" % (key, identifier))
+                                     .encode('utf-8')) / 2. ** 32)
+            candidates.append((score, name, identifier, source))
+        sort = body.get('sort')
+        if sort or 'scroll' in params:
+            candidates.sort(key=lambda c: (-c[0], "publication#" + c[2]))
+            after = body.get('search_after')
+            if after:
+                after = (-after[0], after[1])
+                candidates = [c for c in candidates
+                              if (-c[0], "publication#" + c[2]) > after]
+            top = candidates[start:start + size]
+        else:
+            top = heapq.nlargest(start + size, candidates,
+                                 key=lambda c: c[:3])[start:]
+        with_source = body.get('_source', params.get('_source', True))
+        if body.get('stored_fields', params.get('stored_fields')) == '_none_':
+            with_source = False
+        hits = []
+        for score, name, identifier, source in top:
+            hit = {"_index": name, "_type": "publication", "_id": identifier,
+                   "_score": score}
+            if with_source not in (False, 'false'):
+                hit["_source"] = source
+            if sort:
+                hit["sort"] = [score, "publication#" + identifier]
+            hits.append(hit)
+        response = {"took": 1, "timed_out": False,
+                    "_shards": {"total": 1, "successful": 1, "failed": 0},
+                    "hits": {"total": len(candidates),
+                             "max_score": top[0][0] if top else None,
+                             "hits": hits}}
+        if params.get('scroll'):
+            with self._lock:
+                self._next_id += 1
+                scroll_id = "scroll-%d" % self._next_id
+                self.scrolls[scroll_id] = (dict(body, size=size, **{'from': 0}),
+                                           names, start + size)
+            response["_scroll_id"] = scroll_id
+        return response
+
+    def scroll(self, scroll_id):
+        """ The next page of a scroll """
+        with self._lock:
+            if scroll_id not in self.scrolls:
+                raise StandInError(404, "search_context_missing_exception",
+                                   "No search context found for id [%s]"
+                                   % scroll_id)
+            body, names, start = self.scrolls[scroll_id]
+            self.scrolls[scroll_id] = (body, names, start + body['size'])
+        # same order as the first page, no new context
+        response = self.search(names, dict(body, **{'from': start}),
+                               {'scroll': None})
+        response["_scroll_id"] = scroll_id
+        return response
+
+    def clear_scroll(self, scroll_ids):
+        with self._lock:
+            freed = sum(self.scrolls.pop(scroll_id, None) is not None
+                        for scroll_id in scroll_ids)
+        return {"succeeded": True, "num_freed": freed}
+
+    def msearch(self, body, index=None):
+        lines = [line for line in body.decode('utf-8').splitlines()
+                 if line.strip()]
+        responses = []
+        for header, request in zip(lines[::2], lines[1::2]):
+            header = json.loads(header)
+            try:
+                names = self.resolve(header.get('index', index))
+                responses.append(self.search(names, json.loads(request)))
+            except StandInError as e:
+                responses.append(e.body())
+        return {"responses": responses}
+
+    def render(self, request):
+        """ The search body of a template request, {"id" or "inline",
+        "params"} """
+        if 'id' in request:
+            if request['id'] not in self.templates:
+                raise StandInError(404, "resource_not_found_exception",
+                                   "unable to find script [%s]"
+                                   % request['id'])
+            source = self.templates[request['id']]
+        else:
+            source = request.get('inline', request.get('source', {}))
+        if not isinstance(source, str):
+            source = json.dumps(source)
+        try:
+            return json.loads(render_template(source,
+                                              request.get('params', {})))
+        except ValueError as e:
+            raise StandInError(400, "parse_exception",
+                               "rendered template is no json: %s" % e)
+
+    def msearch_template(self, body, index=None):
+        lines = [line for line in body.decode('utf-8').splitlines()
+                 if line.strip()]
+        responses = []
+        for header, request in zip(lines[::2], lines[1::2]):
+            header = json.loads(header)
+            try:
+                names = self.resolve(header.get('index', index))
+                responses.append(self.search(
+                    names, self.render(json.loads(request))))
+            except StandInError as e:
+                responses.append(e.body())
+        return {"responses": responses}
+
+    def reindex(self, body, requests_per_second=None):
+        """ Copies the documents at once and returns the id of a completed
+        reindex task """
+        source = body['source']['index']
+        names = self.resolve(','.join(source) if isinstance(source, list)
+                             else source)
+        dest = body['dest']['index']
+        created = updated = 0
+        for name in names:
+            for identifier, source in list(self.indices[name]['docs'].items()):
+                item = self._bulk_item('index', {'_id': identifier}, source,
+                                       dest, None, inject=False)
+                created += item.get('result') == 'created'
+                updated += item.get('result') == 'updated'
+        with self._lock:
+            task = "standin:%d" % (len(self.tasks) + 1)
+            status = {"total": created + updated, "created": created,
+                      "updated": updated, "deleted": 0, "batches": 1,
+                      "version_conflicts": 0, "noops": 0,
+                      "requests_per_second": requests_per_second or -1}
+            self.tasks[task] = {"completed": True,
+                                "task": {"node": "standin", "id": task,
+                                         "action": "indices:data/write/reindex",
+                                         "status": status},
+                                "response": dict(status, took=1,
+                                                 timed_out=False,
+                                                 failures=[])}
+        return task
+
+    def thread_pool_stats(self):
+        return {"nodes": {"standin": {"name": "standin", "thread_pool": {
+            "bulk": {"threads": 1, "queue": 0, "active": 0,
+                     "rejected": self.n_rejected}}}}}
+
+    def count(self, names):
+        total = 0
+        for name in names:
+            total += self.indices[name]['count'] or self.synthetic_docs
+        return {"count": total,
+                "_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    # statistics
+
+    def index_stats(self, names):
+        """ _stats?level=shards, one shard per index whose commit
+        generation counts the writes """
+        result = {}
+        for name in names:
+            index = self.indices[name]
+            docs = {"count": index['count'], "deleted": 0}
+            shard = {"routing": {"primary": True}, "docs": docs,
+                     "commit": {"generation": index['writes'],
+                                "id": "standin-%d" % index['writes']}}
+            result[name] = {"primaries": {"docs": docs},
+                            "total": {"docs": docs},
+                            "shards": {"0": [shard]}}
+        return {"_shards": {"total": len(names), "successful": len(names),
+                            "failed": 0},
+                "indices": result}
+
+    def _field_counts(self, names, field):
+        """ total term freqs, doc freqs and doc/term counts of field """
+        ttf, df = Counter(), Counter()
+        doc_count = sum_ttf = sum_df = 0
+        for _, _, source in self._documents(names):
+            text = field_text(source, field)
+            if text is None:
+                continue
+            counts = Counter(t for t, _, _ in tokenize(text))
+            ttf.update(counts)
+            df.update(counts.keys())
+            doc_count += 1
+            sum_ttf += sum(counts.values())
+            sum_df += len(counts)
+        return ttf, df, doc_count, sum_ttf, sum_df
+
+    def termvectors(self, names, doc_type, body, identifier=None,
+                    params=None):
+        body = body or {}
+        params = params or {}
+        fields = body.get('fields') or params.get('fields', '').split(',')
+        source = body.get('doc')
+        if source is None:
+            source = self.indices[names[0]]['docs'].get(identifier) or {}
+        term_statistics = str(body.get('term_statistics',
+                                       params.get('term_statistics',
+                                                  False))).lower() == 'true'
+        vectors = {}
+        for field in [f for f in fields if f]:
+            text = field_text(source, field)
+            if text is None:
+                continue
+            ttf, df, doc_count, sum_ttf, sum_df = self._field_counts(names,
+                                                                     field)
+            terms = {}
+            for position, (token, start, end) in enumerate(tokenize(text)):
+                term = terms.setdefault(token, {"term_freq": 0, "tokens": []})
+                term["term_freq"] += 1
+                term["tokens"].append({"position": position,
+                                       "start_offset": start,
+                                       "end_offset": end})
+                if term_statistics and ttf[token]:
+                    term.update(ttf=ttf[token], doc_freq=df[token])
+            vectors[field] = {"field_statistics": {"sum_doc_freq": sum_df,
+                                                   "doc_count": doc_count,
+                                                   "sum_ttf": sum_ttf},
+                              "terms": terms}
+        return {"_index": names[0], "_type": doc_type, "_id": identifier,
+                "_version": 0, "found": True, "took": 1,
+                "term_vectors": vectors}
+
+    def field_stats(self, names, fields, level='cluster'):
+        def stats(names):
+            result = {}
+            for field in fields:
+                _, _, doc_count, sum_ttf, sum_df = self._field_counts(names,
+                                                                      field)
+                max_doc = sum(self.indices[n]['count'] or self.synthetic_docs
+                              for n in names)
+                result[field] = {"max_doc": max_doc, "doc_count": doc_count,
+                                 "density": (100 * doc_count // max_doc
+                                             if max_doc else 0),
+                                 "sum_doc_freq": sum_df,
+                                 "sum_total_term_freq": sum_ttf,
+                                 "searchable": True, "aggregatable": False}
+            return {"fields": result}
+        if level == 'indices':
+            indices = dict((name, stats([name])) for name in names)
+        else:
+            indices = {"_all": stats(names)}
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0},
+                "indices": indices}
+
+    def cat_indices(self, names, verbose=False):
+        rows = [("green", "open", name, "1", "0",
+                 str(self.indices[name]['count']), "0")
+                for name in names]
+        if verbose:
+            rows.insert(0, ("health", "status", "index", "pri", "rep",
+                            "docs.count", "docs.deleted"))
+        return ''.join(' '.join(row) + '\n' for row in rows)
+
+
+def analyze(text):
+    """ Response of _analyze for text, with a lowercasing word tokenizer """
+    if isinstance(text, list):
+        text = ' '.join(text)
+    return {"tokens": [{"token": token, "start_offset": start,
+                        "end_offset": end, "type": "<ALPHANUM>",
+                        "position": position}
+                       for position, (token, start, end)
+                       in enumerate(tokenize(text))]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Routes the requests to the StandIn of the server """
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, avoid delayed acks
+    disable_nagle_algorithm = True
+    ok = {"acknowledged": True}
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body, content_type="application/json"):
+        if isinstance(body, str):
+            payload = body.encode('utf-8')
+        else:
+            payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _handle(self):
+        standin = self.server.standin
+        split = urlsplit(self.path)
+        parts = [unquote(p) for p in split.path.split('/') if p]
+        params = dict((k, v[-1]) for k, v in parse_qs(split.query).items())
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        endpoint = next((p for p in parts if p.startswith('_')), '/')
+        standin.requests[endpoint] += 1
+        standin.delay()
+        try:
+            if endpoint not in ('/', '_cat', '_cluster', '_alias',
+                                '_aliases', '_settings', '_tasks', '_nodes'):
+                standin.inject()
+            status, body = self._route(standin, parts, params, raw)
+        except StandInError as e:
+            status, body = e.status, e.body()
+        if isinstance(body, str):
+            self._respond(status, body, content_type="text/plain")
+        else:
+            if params.get('filter_path'):
+                body = filter_path(body, [path.split('.') for path in
+                                          params['filter_path'].split(',')])
+            self._respond(status, body or {})
+
+    def _json(self, raw):
+        if not raw:
+            return None
+        try:
+            return json.loads(raw.decode('utf-8'))
+        except ValueError:
+            # e.g. the plain text body of _analyze
+            return raw.decode('utf-8')
+
+    def _route(self, standin, parts, params, raw):
+        method = self.command
+        if not parts:
+            return 200, {"name": "standin", "cluster_name": "standin",
+                         "version": {"number": "5.4.0"},
+                         "tagline": "You Know, for Search"}
+        ops = [p for p in parts if p.startswith('_')]
+        op = ops[0] if ops else None
+        head = parts[:parts.index(op)] if op else parts
+        tail = parts[parts.index(op) + 1:] if op else []
+        index = head[0] if head else None
+        doc_type = head[1] if len(head) > 1 else None
+
+        if op == '_bulk':
+            return 200, standin.bulk(raw, index, doc_type)
+        if op == '_search' and tail[:1] == ['template'] and len(tail) > 1:
+            if method == 'DELETE':
+                found = standin.templates.pop(tail[1], None) is not None
+                return (200 if found else 404), {"acknowledged": found}
+            if method == 'GET':
+                if tail[1] not in standin.templates:
+                    return 404, {"_id": tail[1], "found": False}
+                return 200, {"_id": tail[1], "found": True,
+                             "template": standin.templates[tail[1]]}
+            body = self._json(raw) or {}
+            standin.templates[tail[1]] = body.get('template',
+                                                  body.get('script'))
+            return 200, {"acknowledged": True}
+        if op == '_search' and tail[:1] == ['template']:
+            return 200, standin.search(standin.resolve(index),
+                                       standin.render(self._json(raw) or {}),
+                                       params)
+        if op == '_msearch' and tail[:1] == ['template']:
+            return 200, standin.msearch_template(raw, index)
+        if op == '_search' and tail[:1] == ['scroll']:
+            body = self._json(raw) or {}
+            scroll_ids = tail[1:] or body.get('scroll_id') or \
+                params.get('scroll_id', '').split(',')
+            if method == 'DELETE':
+                if isinstance(scroll_ids, str):
+                    scroll_ids = [scroll_ids]
+                return 200, standin.clear_scroll(scroll_ids)
+            if isinstance(scroll_ids, list):
+                scroll_ids = scroll_ids[0]
+            return 200, standin.scroll(scroll_ids)
+        if op == '_search':
+            return 200, standin.search(standin.resolve(index),
+                                       self._json(raw), params)
+        if op == '_msearch':
+            return 200, standin.msearch(raw, index)
+        if op == '_count':
+            return 200, standin.count(standin.resolve(index))
+        if op == '_stats':
+            return 200, standin.index_stats(standin.resolve(index))
+        if op == '_analyze':
+            body = self._json(raw) or params
+            if isinstance(body, dict):
+                body = body.get('text', '')
+            return 200, analyze(body)
+        if op == '_termvectors':
+            identifier = head[2] if len(head) > 2 else None
+            return 200, standin.termvectors(standin.resolve(index), doc_type,
+                                            self._json(raw), identifier,
+                                            params)
+        if op == '_mtermvectors':
+            body = self._json(raw) or {}
+            docs = body.get('docs') or [{"_id": i}
+                                        for i in body.get('ids', [])]
+            return 200, {"docs": [standin.termvectors(
+                standin.resolve(doc.get('_index', index)),
+                doc.get('_type', doc_type), doc, doc.get('_id'), params)
+                for doc in docs]}
+        if op == '_field_stats':
+            body = self._json(raw) or {}
+            fields = body.get('fields') or params.get('fields', '').split(',')
+            return 200, standin.field_stats(standin.resolve(index), fields,
+                                            params.get('level', 'cluster'))
+        if op == '_cat':
+            names = standin.resolve(tail[1] if len(tail) > 1 else None)
+            verbose = params.get('v') in ('', 'true')
+            if params.get('format') == 'json':
+                return 200, [{"health": "green", "status": "open",
+                              "index": name,
+                              "docs.count": str(standin.indices[name]
+                                                ['count'])}
+                             for name in names]
+            return 200, standin.cat_indices(names, verbose)
+        if op == '_settings':
+            names = standin.resolve(index)
+            if method == 'PUT':
+                body = self._json(raw) or {}
+                for name in names:
+                    settings = standin.indices[name]['settings']
+                    settings['index'].update(
+                        index_settings(body)['index'])
+                return 200, self.ok
+            return 200, dict((name, {"settings": standin.indices[name]
+                                     ['settings']}) for name in names)
+        if op in ('_refresh', '_forcemerge', '_flush'):
+            standin.resolve(index)
+            return 200, {"_shards": {"total": 1, "successful": 1,
+                                     "failed": 0}}
+        if op == '_reindex':
+            if '_rethrottle' in tail:
+                task = standin.tasks[tail[0]]['task']
+                task['status']['requests_per_second'] = float(
+                    params.get('requests_per_second', -1))
+                return 200, {"nodes": {"standin": {"tasks": {tail[0]: task}}}}
+            task = standin.reindex(self._json(raw),
+                                   params.get('requests_per_second'))
+            if params.get('wait_for_completion') == 'false':
+                return 200, {"task": task}
+            return 200, standin.tasks[task]['response']
+        if op == '_tasks':
+            if not tail or tail[0] not in standin.tasks:
+                raise StandInError(404, "resource_not_found_exception",
+                                   "task [%s] isn't running"
+                                   % '/'.join(tail))
+            return 200, standin.tasks[tail[0]]
+        if op == '_nodes':
+            return 200, standin.thread_pool_stats()
+        if op == '_cluster':
+            return 200, {"cluster_name": "standin", "status": "green",
+                         "timed_out": False}
+        if op == '_aliases':
+            standin.update_aliases((self._json(raw) or {}).get('actions', []))
+            return 200, self.ok
+        if op == '_alias':
+            names = tail[0].split(',') if tail else list(standin.aliases)
+            found = dict((index_name, {"aliases": {}})
+                         for index_name in standin.resolve(index))
+            result = {}
+            for alias in names:
+                for member in standin.aliases.get(alias, ()):
+                    if member in found:
+                        result.setdefault(member, {"aliases": {}})[
+                            "aliases"][alias] = {}
+            if not result:
+                raise StandInError(404, "aliases_not_found_exception",
+                                   "alias [%s] missing" % ','.join(names))
+            return 200, result
+        if op is None and len(head) == 1:
+            if method == 'PUT':
+                standin.create_index(index, self._json(raw))
+                return 200, self.ok
+            if method == 'DELETE':
+                standin.delete_index(index)
+                return 200, self.ok
+            names = standin.resolve(index)
+            return 200, dict((name, {"settings": standin.indices[name]
+                                     ['settings'],
+                                     "mappings": standin.indices[name]
+                                     ['mappings'],
+                                     "aliases": {}}) for name in names)
+        raise StandInError(400, "illegal_argument_exception",
+                           "standin does not implement %s %s"
+                           % (method, self.path))
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+
+def main():
+    """ Serves a stand-in elasticsearch until interrupted """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="Seconds every request is delayed")
+    parser.add_argument("--jitter", type=float, default=0.,
+                        help="Up to this many seconds are added to latency")
+    parser.add_argument("--error-rate", type=float, default=0.,
+                        help="Fraction of requests answered with\
+                        --error-status")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--item-error-rate", type=float, default=0.,
+                        help="Fraction of bulk items rejected with 429")
+    parser.add_argument("--max-body-mb", type=float, default=0.,
+                        help="Answer larger bulk requests with 413")
+    parser.add_argument("--synthetic-docs", type=int, default=1000,
+                        help="Documents searches hit in an empty index")
+    parser.add_argument("--discard-sources", action='store_true',
+                        help="Count bulked documents without storing them")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    standin = StandIn(args.host, args.port, latency=args.latency,
+                      jitter=args.jitter, error_rate=args.error_rate,
+                      error_status=args.error_status,
+                      item_error_rate=args.item_error_rate,
+                      max_body_bytes=int(args.max_body_mb * 1024 * 1024),
+                      synthetic_docs=args.synthetic_docs,
+                      keep_sources=not args.discard_sources, seed=args.seed)
+    print("[standin] Serving on %s" % standin.url)
+    try:
+        standin.serve_forever()
+    except KeyboardInterrupt:
+        print("[standin] Requests served:", dict(standin.requests))
+
+
+if __name__ == '__main__':
+    main()
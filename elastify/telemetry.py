@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding=utf8 -*-
+"""
+Ingest telemetry for elastify.
+Progress is printed at a fixed interval instead of once per document: docs/s,
+MB/s, chunks in flight and bulk latency percentiles. Optionally, the same
+metrics are appended as json lines to a file for comparing runs.
+"""
+from __future__ import print_function
+from threading import Lock
+from timeit import default_timer
+
+import json
+import sys
+
+
+def percentile(values, q):
+    """ Returns the q-th percentile (0 <= q <= 100) of sorted values """
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(q / 100. * len(values)))]
+
+
+class Telemetry(object):
+    """ Collects ingest metrics and reports them every interval seconds
+
+    :interval: seconds between two reports
+    :metrics: file to append json lines of metrics to, or None
+    :out: stream to print the progress to
+    """
+
+    def __init__(self, interval=2., metrics=None, out=sys.stdout):
+        self.interval = interval
+        self.metrics = metrics
+        self.out = out
+        self.n_success = 0
+        self.n_fails = 0
+        self.n_bytes = 0
+        self.n_chunks = 0
+        self.in_flight = 0
+        self.latencies = []
+        self._lock = Lock()
+        self.start = self._last = default_timer()
+        # counters at the last report, to compute the rates in between
+        self._last_docs = 0
+        self._last_bytes = 0
+        self._last_chunks = 0
+
+    def chunk_started(self):
+        """ Called by the senders when a bulk request goes out """
+        with self._lock:
+            self.in_flight += 1
+
+    def chunk_finished(self, n_bytes, latency):
+        """ Called by the senders when a bulk request was answered """
+        with self._lock:
+            self.in_flight -= 1
+            self.n_chunks += 1
+            self.n_bytes += n_bytes
+            self.latencies.append(latency)
+
+    def result(self, success):
+        """ Counts the result of one item and reports if it is time to """
+        if success:
+            self.n_success += 1
+        else:
+            self.n_fails += 1
+        if default_timer() - self._last >= self.interval:
+            self.report()
+
+    def snapshot(self, since_last=True):
+        """ Returns the metrics as a dict, either of the interval since the
+        last report or of the whole run """
+        now = default_timer()
+        with self._lock:
+            n_docs = self.n_success + self.n_fails
+            if since_last:
+                elapsed = now - self._last
+                docs = n_docs - self._last_docs
+                n_bytes = self.n_bytes - self._last_bytes
+                latencies = sorted(self.latencies[self._last_chunks:])
+            else:
+                elapsed = now - self.start
+                docs, n_bytes = n_docs, self.n_bytes
+                latencies = sorted(self.latencies)
+            elapsed = max(elapsed, 1e-9)
+            return {'time': now - self.start,
+                    'succeeded': self.n_success,
+                    'failed': self.n_fails,
+                    'docs_per_s': docs / elapsed,
+                    'mb_per_s': n_bytes / 1024. / 1024. / elapsed,
+                    'in_flight': self.in_flight,
+                    'chunks': self.n_chunks,
+                    'latency_p50_ms': 1000 * percentile(latencies, 50),
+                    'latency_p90_ms': 1000 * percentile(latencies, 90),
+                    'latency_p99_ms': 1000 * percentile(latencies, 99)}
+
+    def report(self):
+        """ Prints the metrics since the last report and writes them to the
+        metrics file """
+        metrics = self.snapshot()
+        print("\r[elastify] %7d succeeded, %7d failed, %7.0f docs/s,"
+              " %6.2f MB/s, %2d in flight, latency p50 %.0f p90 %.0f"
+              " p99 %.0f ms"
+              % (metrics['succeeded'], metrics['failed'],
+                 metrics['docs_per_s'], metrics['mb_per_s'],
+                 metrics['in_flight'], metrics['latency_p50_ms'],
+                 metrics['latency_p90_ms'], metrics['latency_p99_ms']),
+              end='', flush=True, file=self.out)
+        if self.metrics:
+            print(json.dumps(metrics), file=self.metrics, flush=True)
+        with self._lock:
+            self._last = default_timer()
+            self._last_docs = self.n_success + self.n_fails
+            self._last_bytes = self.n_bytes
+            self._last_chunks = len(self.latencies)
+
+    def summary(self):
+        """ Returns the metrics of the whole run as a line of text """
+        metrics = self.snapshot(since_last=False)
+        return ("%d succeeded, %d failed in %d chunks, %.0f docs/s, %.2f MB/s,"
+                " latency p50 %.0f p90 %.0f p99 %.0f ms"
+                % (metrics['succeeded'], metrics['failed'], metrics['chunks'],
+                   metrics['docs_per_s'], metrics['mb_per_s'],
+                   metrics['latency_p50_ms'], metrics['latency_p90_ms'],
+                   metrics['latency_p99_ms']))
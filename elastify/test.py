@@ -1,6 +1,5 @@
 from l2r_features.mk import MKFeatures
 from functools import reduce
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search, MultiSearch, Q
 from elasticsearch_dsl.query import Bool, Query
 from time import time
@@ -12,7 +11,7 @@ try:
 except ImportError:
     import utils
 
-client = Elasticsearch([{"host": "localhost"}], timeout=3600)
+client = utils.client
 
 def multisearch(index, strategy, queries, doc_type=None, prefix=None,size=None):
 	print('strategy: ', type(strategy), strategy._match)
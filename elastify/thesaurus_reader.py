@@ -3,14 +3,6 @@ import string
 from collections import defaultdict
 from warnings import warn
 
-import networkx as nx
-import rdflib as rdf
-
-try:
-    from elastify.nltk_normalization import NltkNormalizer
-except ImportError:
-    from nltk_normalization import NltkNormalizer
-
 _alphabet = set(string.ascii_lowercase + string.digits + ' ')
 
 
@@ -43,7 +35,14 @@ class ThesaurusReader:
         self._vocabulary = None
         self._nodename_index = None
         self._index_nodename = None
-        self.normalizer = NltkNormalizer() if normalize else None
+        self.normalizer = None
+        if normalize:
+            # nltk, networkx and rdflib are only imported when needed
+            try:
+                from elastify.nltk_normalization import NltkNormalizer
+            except ImportError:
+                from nltk_normalization import NltkNormalizer
+            self.normalizer = NltkNormalizer()
         self._query_prefix = 'PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#> ' \
                              'PREFIX skos: <http://www.w3.org/2004/02/skos/core#> ' \
                              'PREFIX zbwext: <zbw.eu/namespaces/zbw-extensions/> ' \
@@ -205,6 +204,7 @@ class ThesaurusReader:
             self.normalize_thesaurus()
 
     def _read_nt(self, resource_path):
+        import rdflib as rdf
         self._graph = rdf.Graph()
         self._graph.parse(resource_path, format="nt")
         self._build_thesaurus_dict()
@@ -273,6 +273,7 @@ class ThesaurusReader:
             return '<' + str(uri) + '>'
 
     def _create_nx_graph(self):
+        import networkx as nx
         self._nx_graph = nx.DiGraph()
         for thesaurus_entry in self.thesaurus.items():
             node = self.nodename_index[thesaurus_entry[0]]
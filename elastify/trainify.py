@@ -1,6 +1,4 @@
 import sys
-import pandas as pd
-import numpy as np
 from functools import reduce
 try:
     import elastify.utils as utils
@@ -12,6 +10,7 @@ except ImportError:
 #             binary=False):
 def trainer(queries, index, strategies, gold_index, gold_strategy,
             size=10000, batches=[5, 5, 5, 5], doctype=None):
+    import pandas as pd
     # index, doctype, prop = index_doctype_prop
 
     records = []
@@ -34,15 +33,14 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
         print('processing', strategy)
         records = []
         for qid, docs in enumerate(
-                utils.execute_multisearch(index, utils.FIELDS[strategy],
-                                          queries, size=size,
-                                          doc_type=doctype)):
-            for doc in docs:
-                print ("doc_title:", doc.meta.title, "doc")
+                utils.execute_paginated(index, utils.FIELDS[strategy],
+                                        queries, size=size,
+                                        doc_type=doctype)):
+            for doc_id, score in zip(docs.ids, docs.scores):
                 records.append({
                     "qid": qid,
-                    "did": doc.meta.id,
-                    strategy: doc.meta.score
+                    "did": doc_id,
+                    strategy: score
                 })
             #print(len(records), "documents found for", qid)
 
@@ -61,6 +59,7 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
 
 def generate_DSSM_Data(queries, index, strategies, gold_index, gold_strategy,
             size=10000, batches=[5, 5, 5, 5], doctype=None):
+    import pandas as pd
     # index, doctype, prop = index_doctype_prop
 
     records = []
@@ -113,6 +112,8 @@ def generate_trainingdata(queryfile,
     :returns: TODO
 
     """
+    import numpy as np
+    import pandas as pd
     index, doctype, prop = index_doctype_prop
     queries = [querystring.strip() for querystring in queryfile.readlines()]
     records = []
@@ -182,6 +183,7 @@ def print_l2r(df, outfile):
 
         
 def process_dssm_scores (gs, dssm_scores_file="../results/dssm_out.score.txt", cdssm_scores_file="../results/cdssm_out.score.txt",batches=[5, 5, 5, 5]):
+    import pandas as pd
     #You have to calculate the DSSM scores of the df output file first
     dssm_scores= pd.read_csv(dssm_scores_file, header=None,sep=r"\s+")
     cdssm_scores= pd.read_csv(cdssm_scores_file, header=None,sep=r"\s+")
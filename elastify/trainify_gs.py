@@ -1,9 +1,4 @@
 import sys
-import pandas as pd
-import numpy as np
-import elastify.l2r_features.mk as mk
-import elastify.l2r_features.semantic as sm
-import elastify.l2r_features.letor as letor
 import pickle
 from os import listdir
 from os.path import isfile, join
@@ -17,21 +12,25 @@ def trainer(queries_dict, doc_dict, goldstandardfile, strategies,
                 index='trec_titles', index_field='title', index_doctype='publication',
                 lm_index='trec_fulltext', lm_index_field='fulltext', lm_index_doctype='publication',
                 mu=10.0, w2v_model='', let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=10000, batches=[5, 5, 5, 5]):
+                size=10000, batches=[5, 5, 5, 5], jobs=8):
     
+    import pandas as pd
     # for performance we cache some statistics
     total_term_freqs = {}
     
     features = []
     if "mk" in strategies:
+        import elastify.l2r_features.mk as mk
         features.append(mk.MKFeatures(utils.client, ttfs=total_term_freqs, 
                                         index=index, index_field=index_field, doc_type=index_doctype,
                                         lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype, mu=mu))
         strategies.remove("mk")
     if "sm" in strategies:
+        import elastify.l2r_features.semantic as sm
         features.append(sm.SemanticFeatures(w2v_modelfile=w2v_model))
         strategies.remove("sm")
     if "letor" in strategies:
+        import elastify.l2r_features.letor as letor
         features.append(letor.LetorFeatures(utils.client, ttfs=total_term_freqs,
                                 index=index, index_field=index_field, doc_type=index_doctype,
                                 lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype,
@@ -45,15 +44,18 @@ def trainer(queries_dict, doc_dict, goldstandardfile, strategies,
         records = []
         strat = utils.FIELDS[strategy]
         i = 0
-        for query_id, query_text in queries_dict.items():
-            docs = utils.execute_singlesearch(index, strat, query_text, size=size, doc_type=index_doctype)
+        searches = (utils.paginated_search(index, strat.semantic_query(query_text), size=size, doc_type=index_doctype)
+                    for query_text in queries_dict.values())
+        # a failed search raises, the training data must cover every query
+        for query_id, docs in zip(queries_dict, utils.execute_concurrently(searches, jobs=jobs,
+                                                                           raise_on_error=True)):
         
-            for doc in docs:
+            for doc_id, score in zip(docs.ids, docs.scores):
 
                 records.append({
                     "qid": query_id,
-                    "did": doc.meta.id,
-                    strategy: doc.meta.score
+                    "did": doc_id,
+                    strategy: score
                 })
             #print(len(docs), "documents found for", query_id)
 
@@ -203,8 +205,11 @@ def main():
     parser.add_argument('-w', '--w2vmodel', default='/data5/commondata/L2R/GoogleNews-vectors-negative300.bin', type=str, help='The path to the mk word2vec model file')
     parser.add_argument('-x', '--let_mu', default=2000.0, type=float, help='The mu parameter for the letor language model with dirichlet smooting')
     parser.add_argument('-y', '--let_alpha', default=0.1, type=float, help='The alpha parameter for the letor language model with jelinek-mercer smoothing')
+    parser.add_argument('-j', '--jobs', default=8, type=int,
+                        help="Number of searches in flight [8]")
     parser.add_argument('-z', '--let_delta', default=0.7, type=float, help='The delta parameter for the letor language model with absolute discouting')
     args = parser.parse_args()
+    import pandas as pd
     #print(args)
     index = args.index
     lindex = args.lindex
@@ -238,7 +243,7 @@ def main():
                         index=index, index_field=args.field, index_doctype='publication',
                         lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                         mu=args.mu, w2v_model=args.w2vmodel, let_mu=args.let_mu, let_alpha=args.let_alpha,let_delta=args.let_delta,
-                        strategies=strategies, size=size, batches=batches)
+                        strategies=strategies, size=size, batches=batches, jobs=args.jobs)
         df.to_csv(args.outfile, sep='\t', header=False, index=False, mode='w')
         exit(0)
     elif args.type == 'l2r':
@@ -246,7 +251,7 @@ def main():
                         index=index, index_field=args.field, index_doctype=doctype,
                         lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                         mu=args.mu, w2v_model=args.w2vmodel, let_mu=args.let_mu, let_alpha=args.let_alpha,let_delta=args.let_delta,
-                        strategies=strategies, size=size, batches=batches)
+                        strategies=strategies, size=size, batches=batches, jobs=args.jobs)
         print_l2r(df, args.outfile)
         exit(0)
     else:
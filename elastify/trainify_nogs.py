@@ -1,9 +1,4 @@
 import sys
-import pandas as pd
-import numpy as np
-import elastify.l2r_features.mk as mk
-import elastify.l2r_features.semantic as sm
-import elastify.l2r_features.letor as letor
 from functools import reduce
 try:
     import elastify.utils as utils
@@ -47,8 +42,9 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
                 index_field='title', index_doctype='publication',
                 lm_index='trec_fulltext', lm_index_field='fulltext', lm_index_doctype='publication',
                 w2v_model='', mu=10.0, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=10000, batches=[5, 5, 5, 5]):
+                size=10000, batches=[5, 5, 5, 5], jobs=8):
     
+    import pandas as pd
     doc_id_map = {}
      # for performance we cache some statistics
     total_term_freqs = {}
@@ -56,14 +52,17 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
 
     features = []
     if "mk" in strategies:
+        import elastify.l2r_features.mk as mk
         features.append(mk.MKFeatures(utils.client, ttfs=total_term_freqs, 
                                         index=index, index_field=index_field, doc_type=index_doctype,
                                         lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype, mu=mu))
         strategies.remove("mk")
     if "sm" in strategies:
+        import elastify.l2r_features.semantic as sm
         features.append(sm.SemanticFeatures(w2v_modelfile=w2v_model))
         strategies.remove("sm")
     if "letor" in strategies:
+        import elastify.l2r_features.letor as letor
         features.append(letor.LetorFeatures(utils.client, ttfs=total_term_freqs,
                                 index=index, index_field=index_field, doc_type=index_doctype,
                                 lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype,
@@ -76,7 +75,7 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
     for qid, docs in enumerate(
             utils.execute_multi_singlesearch(gold_index, utils.FIELDS[gold_strategy],
                                       queries, size=gold_count,
-                                      doc_type=index_doctype)):
+                                      doc_type=index_doctype, jobs=jobs)):
 
         doc_relevance_pairs = utils.batched(batches, docs)
         for doc_relevance_pair in doc_relevance_pairs:
@@ -98,7 +97,7 @@ def trainer(queries, index, strategies, gold_index, gold_strategy,
         for qid, docs in enumerate(
                 utils.execute_multi_singlesearch(index, utils.FIELDS[strategy],
                                           queries, size=size,
-                                          doc_type=index_doctype)):
+                                          doc_type=index_doctype, jobs=jobs)):
             for doc in docs:
                 doc_id_map[doc.meta.id] = doc.title
                 records.append({
@@ -153,8 +152,9 @@ def trainer_fulltext(queries, index, strategies, gold_index, gold_strategy,
                 index_field='fulltext', index_doctype='publication',
                 lm_index='trec_fulltext', lm_index_field='fulltext', lm_index_doctype='publication',
                 w2v_model='', mu=10.0, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=10000, batches=[5, 5, 5, 5]):
+                size=10000, batches=[5, 5, 5, 5], jobs=8):
     
+    import pandas as pd
     doc_id_map = {}
      # for performance we cache some statistics
     total_term_freqs = {}
@@ -162,14 +162,17 @@ def trainer_fulltext(queries, index, strategies, gold_index, gold_strategy,
 
     features = []
     if "mk" in strategies:
+        import elastify.l2r_features.mk as mk
         features.append(mk.MKFeatures(utils.client, ttfs=total_term_freqs, 
                                         index=index, index_field=index_field, doc_type=index_doctype,
                                         lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype, mu=mu))
         strategies.remove("mk")
     if "sm" in strategies:
+        import elastify.l2r_features.semantic as sm
         features.append(sm.SemanticFeatures(w2v_modelfile=w2v_model))
         strategies.remove("sm")
     if "letor" in strategies:
+        import elastify.l2r_features.letor as letor
         features.append(letor.LetorFeatures(utils.client, ttfs=total_term_freqs,
                                 index=index, index_field=index_field, doc_type=index_doctype,
                                 lm_index=lm_index, lm_index_field=lm_index_field, lm_doc_type=lm_index_doctype,
@@ -182,7 +185,8 @@ def trainer_fulltext(queries, index, strategies, gold_index, gold_strategy,
     for qid, docs in enumerate(
             utils.execute_multi_singlesearch(gold_index, utils.FIELDS[gold_strategy],
                                       queries, size=size,
-                                      doc_type=index_doctype, test_subject=True)):
+                                      doc_type=index_doctype, test_subject=True,
+                                      jobs=jobs)):
 
         #doc_relevance_pairs = utils.batched(batches, docs)
         for doc_relevance_pair in docs:
@@ -204,7 +208,7 @@ def trainer_fulltext(queries, index, strategies, gold_index, gold_strategy,
         for qid, docs in enumerate(
                 utils.execute_multi_singlesearch(index, utils.FIELDS[strategy],
                                           queries, size=size,
-                                          doc_type=index_doctype)):
+                                          doc_type=index_doctype, jobs=jobs)):
             for doc in docs:
                 doc_id_map[doc.meta.id] = doc.fulltext
                 records.append({
@@ -333,6 +337,8 @@ def main():
     parser.add_argument('-w', '--w2vmodel', default='/data3/tbeck/data/GoogleNews-vectors-negative300.bin', type=str, help='The path to the mk word2vec model file')
     parser.add_argument('-x', '--let_mu', default=2000.0, type=float, help='The mu parameter for the letor language model with dirichlet smooting')
     parser.add_argument('-y', '--let_alpha', default=0.1, type=float, help='The alpha parameter for the letor language model with jelinek-mercer smoothing')
+    parser.add_argument('-j', '--jobs', default=8, type=int,
+                        help="Number of searches in flight [8]")
     parser.add_argument('-z', '--let_delta', default=0.7, type=float, help='The delta parameter for the letor language model with absolute discouting')
     args = parser.parse_args()
     #print(args)
@@ -356,7 +362,7 @@ def main():
                 index_field=field, index_doctype=doctype,
                 lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                 mu=10.0, w2v_model=args.w2vmodel, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=size, batches=batches)
+                size=size, batches=batches, jobs=args.jobs)
         df.to_csv(args.outfile, sep='\t', header=False, index=False, mode='w')
         exit(0)
     elif args.type == 'csv':
@@ -364,7 +370,7 @@ def main():
                 index_field=field, index_doctype=doctype,
                 lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                 mu=10.0, w2v_model=args.w2vmodel, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=size, batches=batches)
+                size=size, batches=batches, jobs=args.jobs)
         df.to_csv(args.outfile, header=False, index=False, mode='a')
         exit(0)
     elif args.type == 'l2r':
@@ -372,7 +378,7 @@ def main():
                 index_field=field, index_doctype=doctype,
                 lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                 mu=10.0, w2v_model=args.w2vmodel, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=size, batches=batches)
+                size=size, batches=batches, jobs=args.jobs)
         print_l2r(df, args.outfile)
         exit(0)
         
@@ -381,7 +387,7 @@ def main():
                 index_field=field, index_doctype=doctype,
                 lm_index=lindex, lm_index_field=lfield, lm_index_doctype='publication',
                 mu=10.0, w2v_model=args.w2vmodel, let_mu=2000.0, let_alpha=0.1, let_delta=0.7,
-                size=size, batches=batches)
+                size=size, batches=batches, jobs=args.jobs)
         print_l2r(df, args.outfile)
         exit(0)
     if args.type == 'dssm':
@@ -1,16 +1,33 @@
 """
 Some utils for the elastify package
 """
+import asyncio
+import hashlib
+import json
+import re
 import sys
-from elasticsearch import Elasticsearch
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from weakref import WeakKeyDictionary
+from elasticsearch.exceptions import TransportError
 from elasticsearch_dsl import Search, MultiSearch, Q
 from elasticsearch_dsl.query import Bool, Query
+from elasticsearch_dsl.response import Response
 from collections import defaultdict
+from functools import reduce
+try:
+    import elastify.clients as clients
+except ImportError:
+    import clients
 
-client = Elasticsearch([{"host": "localhost"}], timeout=3600)
+client = clients.LazyClient()
 
 DEBUG = False
 
+# stands in for the query string while a search template is compiled
+TEMPLATE_QUERY = '__elastify_query__'
+
 
 class SemanticQuery(Query):
 
@@ -144,6 +161,27 @@ class Strategy(object):
         q = {"query": {"bool": {"should": clauses}}}
         return q
 
+    def template_source(self):
+        """ The mustache source of a search template of semantic_query, with
+        the parameters query, size and lean (no _source, no stored fields) """
+        body = json.dumps(
+            {"query": self.semantic_query(TEMPLATE_QUERY).to_dict()},
+            sort_keys=True)
+        body = body.replace(json.dumps(TEMPLATE_QUERY),
+                            '{{#toJson}}query{{/toJson}}')
+        return (body[:-1] + ', "size": {{size}}{{#lean}}, "_source": false,'
+                ' "stored_fields": "_none_"{{/lean}}}')
+
+    def template_id(self):
+        """ Id of the search template, from the fields, their boosts and a
+        hash of the source """
+        if getattr(self, '_template_id', None) is None:
+            source = self.template_source()
+            name = re.sub(r'\W+', '-', str(self)).strip('-').lower()
+            self._template_id = "elastify-%s-%s" % (
+                name, hashlib.sha1(source.encode('utf-8')).hexdigest()[:10])
+        return self._template_id
+
     def __str__(self):
         def boost_indicator(field):
             return field if self._boost[field] == 1 else "{}^{}".format(field, self._boost[field])
@@ -159,9 +197,196 @@ def doc_id(doc):
 
 
 def doc_ids(docs):
+    if isinstance(docs, LeanHits):
+        return list(docs.ids)
     return [doc_id(d) for d in docs]
 
 
+# all of a (m)search response that LeanHits needs
+LEAN_FILTER_PATH = ','.join(
+    prefix + path for prefix in ('', 'responses.')
+    for path in ('hits.total', 'hits.hits._id', 'hits.hits._score', 'error',
+                 'status'))
+
+
+class LeanHits(object):
+    """Ids and scores of the hits of a search, without sources
+
+    :ids: list of document ids, best first
+    :scores: array('d') of their scores
+    :total: number of matching documents
+
+    Iterating yields the hits as dicts with _id and _score.
+    """
+    __slots__ = ('ids', 'scores', 'total')
+
+    def __init__(self, ids, scores, total=0):
+        self.ids = ids
+        self.scores = scores
+        self.total = total
+
+    @classmethod
+    def from_response(cls, response):
+        """ Parses a raw search response, raises TransportError for the
+        error entries of an msearch """
+        if 'error' in response:
+            error = response['error']
+            raise TransportError(response.get('status', 'N/A'),
+                                 error.get('type', error)
+                                 if isinstance(error, dict) else error,
+                                 error)
+        hits = response.get('hits', {})
+        hits_list = hits.get('hits', ())
+        return cls([hit['_id'] for hit in hits_list],
+                   array('d', [hit.get('_score') or 0. for hit in hits_list]),
+                   hits.get('total', 0))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for identifier, score in zip(self.ids, self.scores):
+            yield {'_id': identifier, '_score': score}
+
+    def __repr__(self):
+        return "<LeanHits %d of %d>" % (len(self.ids), self.total)
+
+
+def lean_search(search):
+    """Turns a Search or MultiSearch into a callable that asks for ids and
+    scores only, no _source or stored fields, and returns LeanHits (a list
+    of them for a MultiSearch) parsed from the raw response instead of
+    elasticsearch_dsl's Response objects.
+
+    :search: an elasticsearch_dsl Search or MultiSearch
+    :returns: callable performing the request
+
+    """
+    def stripped(s):
+        return s.extra(_source=False, stored_fields='_none_')
+
+    # a connection alias such as elasticsearch_dsl's 'default' means ours
+    es = client if isinstance(search._using, str) else search._using
+    if isinstance(search, MultiSearch):
+        body = reduce(MultiSearch.add, map(stripped, search),
+                      MultiSearch()).to_dict()
+
+        def execute():
+            response = es.msearch(index=search._index,
+                                  doc_type=search._doc_type, body=body,
+                                  filter_path=LEAN_FILTER_PATH,
+                                  **search._params)
+            return [LeanHits.from_response(r)
+                    for r in response.get('responses', ())]
+    else:
+        body = stripped(search).to_dict()
+
+        def execute():
+            return LeanHits.from_response(es.search(
+                index=search._index, doc_type=search._doc_type, body=body,
+                filter_path=LEAN_FILTER_PATH, **search._params))
+    return execute
+
+
+# elasticsearch 5 cannot sort on _id, the _uid breaks ties just as well
+PAGE_SORT = [{"_score": "desc"}, {"_uid": "asc"}]
+LEAN_PAGE_FILTER_PATH = ','.join(('_scroll_id', 'hits.total', 'hits.hits._id',
+                                  'hits.hits._score', 'hits.hits.sort'))
+
+
+def paginate(index, body, doc_type=None, size=None, page_size=1000,
+             scroll=None, lean=False):
+    """Yields the hits of a search one page at a time, so deep result sets
+    need neither a window beyond index.max_result_window nor one giant
+    response. Pages are fetched with search_after on (_score, _uid), or with
+    the scroll API for older clusters.
+
+    :body: search body, its size, from and sort are replaced
+    :size: most hits to yield, None for all
+    :page_size: hits per request
+    :scroll: keep-alive of a scroll context such as '1m', None for
+    search_after
+    :lean: fetch only _id and _score (see lean_search)
+    :returns: generator of raw hits, best first
+
+    """
+    body = dict(body)
+    body.pop('from', None)
+    params = {}
+    if lean:
+        body.update(_source=False, stored_fields='_none_')
+        params['filter_path'] = LEAN_PAGE_FILTER_PATH
+    if not scroll:
+        body['sort'] = PAGE_SORT
+    remaining = size
+    scroll_id = None
+    try:
+        while remaining is None or remaining > 0:
+            body['size'] = (page_size if remaining is None
+                            else min(page_size, remaining))
+            if scroll_id:
+                response = client.scroll(scroll_id=scroll_id, scroll=scroll,
+                                         **params)
+            elif scroll:
+                response = client.search(index=index, doc_type=doc_type,
+                                         body=body, scroll=scroll, **params)
+            else:
+                response = client.search(index=index, doc_type=doc_type,
+                                         body=body, **params)
+            scroll_id = response.get('_scroll_id')
+            hits = response.get('hits', {}).get('hits', [])
+            if remaining is not None:
+                hits = hits[:remaining]
+                remaining -= len(hits)
+            for hit in hits:
+                yield hit
+            if len(hits) < body['size']:
+                return
+            if not scroll:
+                body['search_after'] = hits[-1]['sort']
+    finally:
+        if scroll_id:
+            client.clear_scroll(scroll_id=scroll_id, ignore=404)
+
+
+def paginated_search(index, query, doc_type=None, size=None, page_size=1000,
+                     scroll=None):
+    """Returns a callable that fetches the ids and scores of the hits of a
+    query page by page (see paginate) and returns them as LeanHits, which
+    hold even deep result sets compactly
+
+    :query: an elasticsearch_dsl query, e.g. of Strategy.semantic_query
+    :returns: callable performing the requests
+
+    """
+    body = Search().query(query).to_dict()
+
+    def execute():
+        ids, scores = [], array('d')
+        for hit in paginate(index, body, doc_type=doc_type, size=size,
+                            page_size=page_size, scroll=scroll, lean=True):
+            ids.append(hit['_id'])
+            scores.append(hit.get('_score') or 0.)
+        return LeanHits(ids, scores, len(ids))
+    return execute
+
+
+def execute_paginated(index, strategy, queries, doc_type=None, size=None,
+                      page_size=1000, scroll=None, jobs=4):
+    """Like execute_multisearch with lean=True for deep result sets: the hits
+    of every query are fetched in pages of page_size (see paginated_search),
+    jobs queries concurrently (see execute_concurrently).
+
+    :returns: generator of LeanHits in query order
+
+    """
+    searches = (paginated_search(index, strategy.semantic_query(value),
+                                 doc_type=doc_type, size=size,
+                                 page_size=page_size, scroll=scroll)
+                for value in queries)
+    return execute_concurrently(searches, jobs=jobs, raise_on_error=True)
+
+
 def batched(batches, docs):
     """Splits the documents into relevancy batches
 
@@ -310,31 +535,323 @@ FIELDS =  {"fulltext": Strategy(["fulltext"], index="economics"),
           "letor": Strategy(["TFIDF"], index="economics").prefix("title")
           }
 
+def _batch_limit(size, max_batch, max_response_mb, hit_kb):
+    """ Most searches of size hits per msearch """
+    per_search = (size or 10) * hit_kb / 1024.
+    return int(min(max_batch, max(1, max_response_mb // per_search)))
+
+
+def msearch_batches(searches, size=None, max_batch=100, max_response_mb=50,
+                    hit_kb=1., **kwargs):
+    """Groups searches into MultiSearches small enough for one request
+
+    :searches: iterable of Searches, consumed lazily
+    :size: hits per search, to estimate the response size (default 10)
+    :max_batch: most searches per msearch
+    :max_response_mb: estimated response size limit per msearch
+    :hit_kb: estimated size of a hit in the response
+    :kwargs: passed to MultiSearch (using, index, doc_type)
+    :returns: generator of MultiSearches
+
+    """
+    limit = _batch_limit(size, max_batch, max_response_mb, hit_kb)
+    batch = []
+    for s in searches:
+        batch.append(s)
+        if len(batch) >= limit:
+            yield reduce(MultiSearch.add, batch, MultiSearch(**kwargs))
+            batch = []
+    if batch:
+        yield reduce(MultiSearch.add, batch, MultiSearch(**kwargs))
+
+
 def execute_multisearch(index, strategy, queries, doc_type=None, prefix=None,
-                        size=None):
-    """TODO: Docstring for execute_multisearch.
+                        size=None, max_batch=100, max_response_mb=50,
+                        jobs=4, max_concurrent_searches=None, lean=False,
+                        template=False):
+    """Executes the queries with msearch requests of at most max_batch
+    queries and about max_response_mb of response each (see
+    msearch_batches), jobs of them concurrently (see execute_concurrently).
 
     :index: TODO
     :doctype: TODO
     :prop: TODO
     :strategy: TODO
     :queries: TODO
-    :returns: TODO
+    :max_concurrent_searches: searches elasticsearch runs in parallel for
+    each msearch, None for its default (not with template)
+    :lean: fetch ids and scores only and yield LeanHits (see lean_search)
+    :template: send the strategy's stored search template and the query
+    only, via _msearch/template (see template_batches)
+    :returns: generator of responses in query order
 
     """
     print('strategy: ', type(strategy), strategy._match)
-    ms = MultiSearch(using=client, index=index, doc_type=doc_type) #index=strategy.get_index() , Tilman: ??
-    for value in queries:
-        s = Search().query(strategy.semantic_query(value))
-        if size:
-            s = s[0:size]
-        ms = ms.add(s)
-    responses = ms.execute()
-    return responses
+
+    if template:
+        batches = template_batches(
+            index, ((strategy, value, doc_type, size) for value in queries),
+            _batch_limit(size, max_batch, max_response_mb, 1.), lean=lean)
+    else:
+        batches = msearch_batches(
+            (_search(strategy, value, None, size) for value in queries),
+            size=size, max_batch=max_batch, max_response_mb=max_response_mb,
+            using=client, index=index, doc_type=doc_type) #index=strategy.get_index() , Tilman: ??
+        if max_concurrent_searches:
+            batches = (ms.params(
+                max_concurrent_searches=max_concurrent_searches)
+                       for ms in batches)
+        if lean:
+            batches = map(lean_search, batches)
+    for responses in execute_concurrently(batches, jobs=jobs,
+                                          raise_on_error=True):
+        for response in responses:
+            yield response
+
+
+def execute_fanout(queries, targets, only=None, max_batch=100,
+                   max_response_mb=50, hit_kb=1., jobs=4,
+                   max_concurrent_searches=None, lean=False, template=False):
+    """Executes every query against every target in as few msearch requests
+    as possible, jobs of them concurrently (see execute_concurrently).
+    The searches are grouped by index; the searches of a group are cut into
+    batches of equal length (see msearch_batches for the limits) with the
+    targets of a query next to each other, so cheap and expensive strategies
+    are spread over all batches.
+
+    :queries: the query strings
+    :targets: list of (index, strategy, doc_type, size), index None for
+    strategy.get_index()
+    :only: set of (target position, query position) to search, None for all
+    :max_concurrent_searches: searches elasticsearch runs in parallel for
+    each msearch, None for its default (not with template)
+    :lean: fetch ids and scores only, the responses are LeanHits (see
+    lean_search)
+    :template: send stored search templates and the queries only (see
+    template_batches)
+    :returns: a list per target with the responses in query order, None for
+    the searches left out by only
+
+    """
+    queries = list(queries)
+    groups = defaultdict(list)
+    for qid, value in enumerate(queries):
+        for tid, (index, strategy, doc_type, size) in enumerate(targets):
+            if only is not None and (tid, qid) not in only:
+                continue
+            index = index or strategy.get_index()
+            groups[index].append(((tid, qid),
+                                  (strategy, value, doc_type, size)))
+
+    positions, batches = [], []
+    for index, searches in sorted(groups.items()):
+        size = max(search[3] or 10 for _, search in searches)
+        limit = _batch_limit(size, max_batch, max_response_mb, hit_kb)
+        n_batches = -(-len(searches) // limit)
+        per_batch = -(-len(searches) // n_batches)
+        positions.extend(position for position, _ in searches)
+        if template:
+            batches.extend(template_batches(
+                index, (search for _, search in searches), per_batch,
+                lean=lean))
+            continue
+        batches.extend(msearch_batches(
+            (_search(*search) for _, search in searches), size=size,
+            max_batch=per_batch, max_response_mb=max_response_mb,
+            hit_kb=hit_kb, using=client, index=index))
+    if max_concurrent_searches and not template:
+        batches = [ms.params(max_concurrent_searches=max_concurrent_searches)
+                   for ms in batches]
+    if lean and not template:
+        batches = map(lean_search, batches)
+
+    results = [[None] * len(queries) for _ in targets]
+    positions = iter(positions)
+    for responses in execute_concurrently(batches, jobs=jobs,
+                                          raise_on_error=True):
+        for response, (tid, qid) in zip(responses, positions):
+            results[tid][qid] = response
+    return results
+
+
+def _search(strategy, value, doc_type, size):
+    """ The Search of a query of a strategy """
+    s = Search(doc_type=doc_type).query(strategy.semantic_query(value))
+    if size:
+        s = s[0:size]
+    return s
+
+
+# client => ids of the templates stored with it
+_templates = WeakKeyDictionary()
+_templates_lock = Lock()
+
+
+def register_template(strategy):
+    """Stores the search template of strategy (see Strategy.template_source)
+    in the cluster, once per client, and returns its id
+
+    :strategy: a Strategy
+    :returns: the template id
+
+    """
+    es = clients.get_client()
+    template = strategy.template_id()
+    with _templates_lock:
+        stored = _templates.setdefault(es, set())
+        if template not in stored:
+            es.put_template(id=template,
+                            body={"template": strategy.template_source()})
+            stored.add(template)
+    return template
+
+
+def template_msearch(index, searches, lean=False):
+    """Returns a callable that sends searches in one _msearch/template
+    request, each as the id of its strategy's stored template and the
+    parameters, instead of the full query body
+
+    :searches: list of (strategy, query, doc_type, size)
+    :lean: fetch ids and scores only and return LeanHits
+    :returns: callable returning the list of responses
+
+    """
+    body = []
+    for strategy, value, doc_type, size in searches:
+        body.append({'type': doc_type} if doc_type else {})
+        body.append({'id': register_template(strategy),
+                     'params': {'query': value, 'size': size or 10,
+                                'lean': lean}})
+    params = {'filter_path': LEAN_FILTER_PATH} if lean else {}
+
+    def execute():
+        responses = client.msearch_template(index=index, body=body,
+                                            **params).get('responses', ())
+        if lean:
+            return [LeanHits.from_response(r) for r in responses]
+        out = []
+        for r in responses:
+            if r.get('error', False):
+                raise TransportError('N/A', r['error']['type'], r['error'])
+            out.append(Response(Search(), r))
+        return out
+    return execute
+
+
+def template_batches(index, searches, max_batch, lean=False):
+    """Groups searches, (strategy, query, doc_type, size) tuples, into
+    _msearch/template requests of at most max_batch searches (see
+    template_msearch)
+
+    :returns: generator of callables
+
+    """
+    batch = []
+    for search in searches:
+        batch.append(search)
+        if len(batch) >= max_batch:
+            yield template_msearch(index, batch, lean=lean)
+            batch = []
+    if batch:
+        yield template_msearch(index, batch, lean=lean)
+
+
+def _retryable(error):
+    """ Timeouts, connection errors and rejections are worth a retry """
+    status = getattr(error, 'status_code', None)
+    return status in (429, 503) or not isinstance(status, int)
+
+
+async def _execute(loop, search, retries, timeout, backoff):
+    """ Runs one blocking search in the loop's executor, retrying it with
+    an exponential backoff """
+    attempt = 0
+    while True:
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(None, search),
+                                          timeout)
+        except (TransportError, asyncio.TimeoutError) as e:
+            if attempt >= retries or not _retryable(e):
+                raise
+        await asyncio.sleep(backoff * 2 ** attempt)
+        attempt += 1
+
+
+def execute_concurrently(searches, jobs=8, retries=2, timeout=None,
+                         backoff=1., ordered=True, raise_on_error=False):
+    """Executes searches with at most jobs of them in flight
+
+    :searches: iterable of elasticsearch_dsl Searches (or callables that
+    perform a request), consumed lazily
+    :jobs: number of concurrent requests
+    :retries: retries per search on timeouts, connection errors and
+    rejections
+    :timeout: seconds per attempt, None to wait forever
+    :ordered: yield the responses in the order of the searches, otherwise
+    yield (qid, response) as they arrive, qid being the position of the search
+    :raise_on_error: raise the error of a search that failed for good
+    instead of yielding None
+    :returns: generator of responses, None for searches that failed
+
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(jobs)
+    loop.set_default_executor(executor)
+    # the executor bounds the requests in flight, a few more are queued so
+    # that finished ones are replaced right away
+    window = 2 * jobs
+    searches = enumerate(searches)
+    pending = {}
+
+    def result(qid, task):
+        try:
+            return loop.run_until_complete(task)
+        except Exception as e:
+            if raise_on_error:
+                raise
+            print("[elastify/utils.py] Warning: search %d failed: %s"
+                  % (qid, e or type(e).__name__), file=sys.stderr)
+            return None
+
+    try:
+        next_qid = 0
+        while True:
+            for qid, search in searches:
+                if timeout and hasattr(search, 'params'):
+                    search = search.params(request_timeout=timeout)
+                if hasattr(search, 'execute'):
+                    search = search.execute
+                pending[qid] = loop.create_task(
+                    _execute(loop, search, retries, timeout, backoff))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            if ordered:
+                yield result(next_qid, pending.pop(next_qid))
+                next_qid += 1
+            else:
+                done, _ = loop.run_until_complete(asyncio.wait(
+                    pending.values(), return_when=asyncio.FIRST_COMPLETED))
+                for qid in sorted(qid for qid, task in pending.items()
+                                  if task in done):
+                    yield qid, result(qid, pending.pop(qid))
+    finally:
+        for task in pending.values():
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending.values()))
+        executor.shutdown(wait=False)
+        loop.close()
+
 
 def execute_multi_singlesearch(index, strategy, queries, doc_type=None, prefix=None,
-                                size=None, test_subject=False):
-    """TODO: Docstring for execute_multisearch.
+                                size=None, test_subject=False, jobs=8,
+                                retries=2, timeout=None):
+    """Executes one search per query, jobs of them concurrently (see
+    execute_concurrently), and yields the responses in query order. A query
+    that fails for good raises its error, callers pair the responses with
+    their queries by position.
 
     :index: TODO
     :doctype: TODO
@@ -344,20 +861,26 @@ def execute_multi_singlesearch(index, strategy, queries, doc_type=None, prefix=N
     :returns: TODO
 
     """
-    for value in queries:
-        if not test_subject:
-          q = strategy.semantic_query(value)
-        else:
-          q = strategy.semantic_query_test(value)
-        s = Search(using=client, index=index, doc_type=doc_type).query(q)
-        print (q)
-        if size:
-            s = s[0:size]
-        try:
-            yield s.execute()
-        except:
-            print ("Warning: Skip executing this search")
-            continue
+    def searches():
+        for value in queries:
+            if not test_subject:
+              q = strategy.semantic_query(value)
+            else:
+              q = strategy.semantic_query_test(value)
+            print (q)
+            yield singlesearch(index, q, doc_type=doc_type, size=size)
+
+    for response in execute_concurrently(searches(), jobs=jobs,
+                                         retries=retries, timeout=timeout,
+                                         raise_on_error=True):
+        yield response
+
+def singlesearch(index, query, doc_type=None, size=None):
+    """ Returns the Search for a query of a strategy """
+    s = Search(using=client, index=index, doc_type=doc_type).query(query)
+    if size:
+      s = s[0:size]
+    return s
 
 def execute_singlesearch(index, strategy, query, doc_type=None, prefix=None,
                                 size=None):
@@ -372,13 +895,10 @@ def execute_singlesearch(index, strategy, query, doc_type=None, prefix=None,
 
     """
     q = strategy.semantic_query(query)
-    s = Search(using=client, index=index, doc_type=doc_type).query(q)
-    if size:
-      s = s[0:size]
-    return s.execute()
+    return singlesearch(index, q, doc_type=doc_type, size=size).execute()
 
 def perform_queries(index, doctype, prop, strategy, queries, size=500000,
-                    source=False):
+                    source=False, page_size=None, scroll=None):
     """perform_queries
     :param index:
     the index to perform the queries to
@@ -392,6 +912,12 @@ def perform_queries(index, doctype, prop, strategy, queries, size=500000,
     :param size:
     :param queries:
     :param source:
+    :param page_size:
+    if given, the hits of each query are a generator fetching pages of
+    page_size hits (see paginate) instead of a list from one request
+    :param scroll:
+    keep-alive of a scroll context, to page with scroll instead of
+    search_after
     Executes all the queries as a search query
     against index with doc_type and seperately against each field of fields
     returns a list of dicts
@@ -431,6 +957,10 @@ def perform_queries(index, doctype, prop, strategy, queries, size=500000,
         # multi_match should also be ok for only 1 field
         body = strategy.query_body(querystring)
         body["_source"] = source
+        if page_size:
+            yield paginate(index, body, doc_type=doctype, size=size,
+                           page_size=page_size, scroll=scroll)
+            continue
         body["size"] = size
         # query = querystring2query(querystring)
         result = client.search(index=index, doc_type=doctype, body=body)
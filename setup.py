@@ -11,6 +11,7 @@ setup(name='elastify',
       author="anonymous",
       author_email="anonymous",
       packages=['elastify', 'elastify.l2r_features'],
+      package_data={'elastify': ['thes_prep.yaml']},
       install_requires=requirements,
       entry_points={
             'console_scripts': [
@@ -20,11 +21,11 @@ setup(name='elastify',
                   'elastify=elastify.elastify:main',
                   'querify=elastify.querify:main',
                   'trainify=elastify.trainify:main',
-                  'log2query=elastify.log2query:main', 
-			'querify4labeled=elastify.querify4labeled:main'
                   'log2query=elastify.log2query:main',
+                  'querify4labeled=elastify.querify4labeled:main',
                   'gstrainify=elastify.trainify_gs:main',
                   'nogstrainify=elastify.trainify_nogs:main',
+                  'standin=elastify.standin:main',
             ]
       }
       )